@@ -5,8 +5,21 @@ from datetime import datetime
 from memory_profiler import profile
 from stochastic_service_composition.declare_utils import *
 from stochastic_service_composition.composition_mdp import composition_mdp
-from stochastic_service_composition.composition_mdp import comp_mdp
+from stochastic_service_composition.composition_mdp import comp_mdp, lift_symmetric_policy
 from mdp_dp_rl.algorithms.dp.dp_analytic import DPAnalytic
+from stochastic_service_composition.solvers import (
+    gamma_sweep,
+    policy_iteration,
+    topological_value_iteration,
+    value_iteration,
+)
+from stochastic_service_composition.reductions import (
+    bisimulation_quotient,
+    compress_chains,
+    prune_comp_mdp,
+    prune_composition_mdp,
+)
+from stochastic_service_composition.sparse_mdp import SparseMDP
 from docs.notebooks.utils import print_policy_data
 import os
 import pickle
@@ -19,8 +32,36 @@ if not os.path.exists('experimental_results'):
 config_json = json.load(open('config.json', 'r'))
 mode = config_json['mode']
 size = config_json['size']
+# a single discount factor, or a list of discount factors to be solved on the same composition
 gamma = config_json['gamma']
+gammas = gamma if isinstance(gamma, list) else [gamma]
+gamma_label = "-".join(str(g) for g in gammas)
 serialize = config_json['serialize']
+# "dp_analytic" (mdp_dp_rl), or one of the solvers over the sparse MDP:
+# "vi" (vectorized value iteration), "topological_vi" (value iteration by SCCs),
+# "pi" (policy iteration with sparse LU), "pi_iterative" (policy iteration with BiCGSTAB)
+solver = config_json.get('solver', 'dp_analytic')
+sparse_solvers = {
+    "vi": value_iteration,
+    "topological_vi": topological_value_iteration,
+    "pi": policy_iteration,
+    "pi_iterative": lambda mdp, tol: policy_iteration(mdp, tol, method="iterative"),
+}
+sparse = solver != "dp_analytic"
+# start states of the LTLf composition: "all_idle" (all the idle system states) or "initial" (only the initial one)
+seeding = config_json.get('seeding', 'all_idle')
+# collapse the states that cannot reach the goal into the sink state (sparse solvers only)
+prune = config_json.get('prune', False) and sparse
+# solve the quotient of the composition MDP by probabilistic bisimulation (sparse solvers only)
+bisimulation = config_json.get('bisimulation', False) and sparse
+# compress the deterministic chains through forced states into macro-transitions (sparse solvers only)
+compress = config_json.get('compress', False) and sparse
+# merge the states that only differ by a permutation of identical services (LTLf only)
+symmetry = config_json.get('symmetry', False)
+# do not interleave the forced tau moves of the services (LTLf only): exact only without
+# discounting, hence a validation mode that requires "gamma": 1
+partial_order = config_json.get('partial_order', False)
+assert not partial_order or all(g == 1 for g in gammas), "partial_order requires gamma == 1"
 
 version = config_json['version']
 if version == "v2":
@@ -35,32 +76,105 @@ elif version == "v5":
 now = datetime.now().strftime("%d_%m_%Y-%H_%M_%S")
 
 directory = f"experimental_results"
-file_name = f"{directory}/{now}_time_profiler_{mode}_{size}_{gamma}_{version}.txt"
-fp_compMDP = f"{directory}/{now}_memory_profiler_composition_{mode}_{size}_{gamma}_{version}.log"
-fp_DPAnalytic = f"{directory}/{now}_memory_profiler_policy_{mode}_{size}_{gamma}_{version}.log"
+file_name = f"{directory}/{now}_time_profiler_{mode}_{size}_{gamma_label}_{version}.txt"
+fp_compMDP = f"{directory}/{now}_memory_profiler_composition_{mode}_{size}_{gamma_label}_{version}.log"
+fp_DPAnalytic = f"{directory}/{now}_memory_profiler_policy_{mode}_{size}_{gamma_label}_{version}.log"
+# serialized MDP; LTLf compositions with a non-default seeding explore different states
+mdp_file_name = f'mdp_{mode}_{size}_{version}.pkl'
+if mode == "ltlf" and seeding != "all_idle":
+    mdp_file_name = f'mdp_{mode}_{size}_{version}_{seeding}.pkl'
+if mode == "ltlf" and symmetry:
+    mdp_file_name = mdp_file_name.replace('.pkl', '_symmetry.pkl')
+if mode == "ltlf" and partial_order:
+    mdp_file_name = mdp_file_name.replace('.pkl', '_partial_order.pkl')
 
 # AUTOMATA
 @profile(stream=open(fp_compMDP, "w+"))
 def execute_composition_automata(target, services):
-    mdp = composition_mdp(target, *services, gamma=gamma)
+    mdp = composition_mdp(target, *services, gamma=gammas[0], sparse=sparse)
     return mdp
 
 # LTLf
 @profile(stream=open(fp_compMDP, "w+"))
 def execute_composition_ltlf(declare_automaton, services):
-    mdp = comp_mdp(declare_automaton, services, gamma=gamma)
+    mdp = comp_mdp(declare_automaton, services, gamma=gammas[0], sparse=sparse, seeding=seeding, symmetry=symmetry, partial_order=partial_order)
+    return mdp
+
+# PRUNING
+def prune_mdp(mdp, target):
+    if not prune:
+        return mdp
+    # the MDP may come from a pickle written by a non-sparse run
+    if not isinstance(mdp, SparseMDP):
+        mdp = SparseMDP.from_mdp(mdp)
+    if mode == "automata":
+        mdp, removed_states, removed_transitions = prune_composition_mdp(mdp, target)
+    else:
+        mdp, removed_states, removed_transitions = prune_comp_mdp(mdp, target)
+    to_write = f"Pruned states: {removed_states}\nPruned transitions: {removed_transitions}"
+    with open(file_name, "a") as f:
+        f.write(f"{to_write}\n")
+    print(to_write)
     return mdp
 
 # POLICY
-@profile(stream=open(fp_DPAnalytic, "w+"))
-def execute_policy(mdp):
-    mdp.gamma = gamma
+def compute_policy(mdp, policy_gamma, quotient=None):
+    mdp.gamma = policy_gamma
+    if solver in sparse_solvers:
+        # the macro-transitions depend on the discount factor: compress for each one
+        compression = compress_chains(mdp) if compress else None
+        result = sparse_solvers[solver](mdp if compression is None else compression.compressed, 1e-4)
+        return lift_policy(result, quotient, compression)
     opn = DPAnalytic(mdp, 1e-4)
     opt_policy = opn.get_optimal_policy_vi()
     return opt_policy
+
+def lift_policy(result, quotient, compression=None):
+    # the policy of the composition MDP, from the solution of its compressed form and/or of its quotient
+    if compression is not None:
+        result = compression.lift(result)
+    return (result if quotient is None else quotient.lift(result)).policy
+
+@profile(stream=open(fp_DPAnalytic, "w+"))
+def execute_policy(mdp):
+    # the transitions are converted once and shared by all the discount factors;
+    # returns a list of (gamma, policy, elapsed time in seconds)
+    if sparse and not isinstance(mdp, SparseMDP):
+        mdp = SparseMDP.from_mdp(mdp)
+    if not sparse and isinstance(mdp, SparseMDP):
+        mdp = mdp.to_mdp()
+    quotient = None
+    if bisimulation:
+        # solve the quotient by bisimulation, the policy is lifted back to the composition MDP
+        quotient = bisimulation_quotient(mdp)
+        to_write = f"Bisimulation quotient states: {quotient.quotient.nb_states}"
+        with open(file_name, "a") as f:
+            f.write(f"{to_write}\n")
+        print(to_write)
+        mdp = quotient.quotient
+    if solver == "vi" and not compress:
+        # warm start each discount factor from the values of the previous one
+        return [
+            (result.mdp.gamma, lift_policy(result, quotient), result.elapsed_time)
+            for result in gamma_sweep(mdp, gammas, 1e-4)
+        ]
+    results = []
+    for policy_gamma in gammas:
+        now = time.time_ns()
+        opt_policy = compute_policy(mdp, policy_gamma, quotient)
+        results.append((policy_gamma, opt_policy, (time.time_ns() - now) / 10 ** 9))
+    return results
+
+def write_policy_results(policy_results):
+    # one record per discount factor
+    with open(file_name, "a") as f:
+        for policy_gamma, _, elapsed in policy_results:
+            to_write = f"Gamma: {policy_gamma}\nPolicy elapsed time: {elapsed} s\n"
+            f.write(to_write)
+            print(to_write, end="")
     
 def main():
-    to_write = f"Mode: {mode}\nSize: {size}\nGamma: {gamma}\nSerialize: {serialize}\nVersion: {version}"
+    to_write = f"Mode: {mode}\nSize: {size}\nGamma: {gamma}\nSerialize: {serialize}\nVersion: {version}\nSolver: {solver}"
     with open(file_name, "w+") as f:
         f.write(f"{to_write}\n")
     print(to_write)
@@ -78,10 +192,10 @@ def main():
     # AUTOMATA
     if mode == "automata":
         # check if the pickle file exists and has size > 0
-        if serialize and os.path.isfile(f'mdp_{mode}_{size}_{version}.pkl') and os.path.getsize(f'mdp_{mode}_{size}_{version}.pkl') > 0:
+        if serialize and os.path.isfile(mdp_file_name) and os.path.getsize(mdp_file_name) > 0:
             print("MDP already computed. Importing from pickle file...")
             #import the mdp from the pickle file
-            with open(f'mdp_{mode}_{size}_{version}.pkl', 'rb') as f:
+            with open(mdp_file_name, 'rb') as f:
                 mdp = pickle.load(f)
             elapsed1 = 0
         else:
@@ -92,29 +206,26 @@ def main():
             if serialize:
                 #save mdp into a pickle file
                 try:
-                    with open(f'mdp_{mode}_{size}_{version}.pkl', 'wb') as f:
+                    with open(mdp_file_name, 'wb') as f:
                         pickle.dump(mdp, f, pickle.HIGHEST_PROTOCOL)
                 except Exception as e:
                     print(e)
+        mdp = prune_mdp(mdp, target)
         states = len(mdp.all_states)
         with open(file_name, "a") as f:
             to_write = f"MDP states: {states}\nComposition elapsed time: {elapsed1} s\n"
             f.write(to_write)
         print("Number of states: ", states)
         print("Composition MDP computed.\nStarting computing policy...")
-        now = time.time_ns()
-        opt_policy = execute_policy(mdp)
-        elapsed2 = (time.time_ns() - now) / 10 ** 9
-        with open(file_name, "a") as f:
-            to_write = f"Policy elapsed time: {elapsed2} s\n"
-            f.write(to_write)
+        policy_results = execute_policy(mdp)
+        write_policy_results(policy_results)
     # LTLf
     elif mode == "ltlf":
         # check if the pickle file exists and has size > 0
-        if serialize and os.path.isfile(f'mdp_{mode}_{size}_{version}.pkl') and os.path.getsize(f'mdp_{mode}_{size}_{version}.pkl') > 0:
+        if serialize and os.path.isfile(mdp_file_name) and os.path.getsize(mdp_file_name) > 0:
             print("MDP already computed. Importing from pickle file...")
             #import the mdp from the pickle file
-            with open(f'mdp_{mode}_{size}_{version}.pkl', 'rb') as f:
+            with open(mdp_file_name, 'rb') as f:
                 mdp = pickle.load(f)
             elapsed1 = 0
         else:
@@ -125,22 +236,26 @@ def main():
             if serialize:
                 #save mdp into a pickle file
                 try:
-                    with open(f'mdp_{mode}_{size}_{version}.pkl', 'wb') as f:
+                    with open(mdp_file_name, 'wb') as f:
                         pickle.dump(mdp, f, pickle.HIGHEST_PROTOCOL)
                 except Exception as e:
                     print(e)
+        explored_states = len(mdp.all_states)
+        mdp = prune_mdp(mdp, target)
         states = len(mdp.all_states)
         with open(file_name, "a") as f:
-            to_write = f"MDP states: {states}\nComposition elapsed time: {elapsed1} s\n"
+            to_write = f"MDP states: {states}\nExplored states ({seeding} seeding): {explored_states}\nComposition elapsed time: {elapsed1} s\n"
             f.write(to_write)
         print("Number of states: ", states)
         print("Composition MDP computed.\nStarting computing policy...")
-        now = time.time_ns()
-        opt_policy = execute_policy(mdp)
-        elapsed2 = (time.time_ns() - now) / 10 ** 9
-        with open(file_name, "a") as f:
-            to_write = f"Policy elapsed time: {elapsed2} s\n"
-            f.write(to_write)
+        policy_results = execute_policy(mdp)
+        if symmetry:
+            # the actions of the symmetry-reduced MDP refer to the canonical states: map them to the services
+            policy_results = [
+                (policy_gamma, lift_symmetric_policy(opt_policy, all_services), elapsed)
+                for policy_gamma, opt_policy, elapsed in policy_results
+            ]
+        write_policy_results(policy_results)
     
     print("Policy computed.")
 
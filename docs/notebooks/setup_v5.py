@@ -3,7 +3,12 @@ from stochastic_service_composition.target import build_target_from_transitions
 from stochastic_service_composition.declare_utils import *
 import logaut
 import pylogics.parsers.ldl
-from stochastic_service_composition.dfa_target import from_symbolic_automaton_to_declare_automaton
+from stochastic_service_composition.dfa_cache import cached_dfa
+from stochastic_service_composition.dfa_target import (
+    declare_constraints_to_dfa,
+    from_symbolic_automaton_to_declare_automaton,
+    ltlf_to_simple_alphabet_dfa,
+)
 
 LOW_PROB = 0.05
 
@@ -587,55 +592,75 @@ def target_service_automata():
     )
 
 
-def target_service_ltlf():
-    '''Builds the target service LTLf formula from the DECLARE constraints and symbols.'''
+def target_service_ltlf(compiler="lydia"):
+    '''Builds the target service LTLf formula from the DECLARE constraints and symbols.
+
+    The DFA is compiled with Lydia ("lydia"), with Lydia but without the declare assumption
+    ("simple_alphabet"), or compositionally, constraint by constraint ("compositional").'''
     # declare process specification
     declare_constraints = [
-        exactly_once(PICK_DESIGN),
-        exactly_once(PICK_SILICON),
-        exactly_once(PICK_IMPURITIES),
-        exactly_once(PICK_RESIST),
-        exactly_once(PICK_CHEMICALS),
-        exactly_once(MASK_CREATION),
-        exactly_once(PHOTOLITOGRAPHY),
-        exactly_once(ION_IMPLANTATION),
-        exactly_once(DICING),
-
-        absence_2(TESTING),
-        absence_2(SMART_TESTING),
-        absence_2(QUALITY),
-        absence_2(PACKAGING_COOLING),
-        absence_2(PACKAGING),
-
-        alt_succession(PICK_DESIGN, MASK_CREATION),
-        alt_succession(PICK_SILICON, MASK_CREATION),
-        alt_succession(PICK_IMPURITIES, MASK_CREATION),
-        alt_succession(PICK_RESIST, MASK_CREATION),
-        alt_succession(PICK_CHEMICALS, MASK_CREATION),
-
-        alt_succession(MASK_CREATION, PHOTOLITOGRAPHY),
-        alt_succession(PHOTOLITOGRAPHY, ION_IMPLANTATION),
-
-        alt_precedence(ION_IMPLANTATION, TESTING),
-        alt_precedence(ION_IMPLANTATION, SMART_TESTING),
-
-        alt_succession(SMART_TESTING, QUALITY),
-
-        alt_response(TESTING, DICING),
-        alt_response(QUALITY, DICING),
-        precedence_or(TESTING, QUALITY, DICING),
-
-        alt_precedence(DICING, PACKAGING),
-        alt_precedence(DICING, PACKAGING_COOLING),
-
-        not_coexistence(TESTING, SMART_TESTING),
-        not_coexistence(PACKAGING, PACKAGING_COOLING),
-
-        build_declare_assumption(ALL_SYMBOLS_SET)
+        (exactly_once, PICK_DESIGN),
+        (exactly_once, PICK_SILICON),
+        (exactly_once, PICK_IMPURITIES),
+        (exactly_once, PICK_RESIST),
+        (exactly_once, PICK_CHEMICALS),
+        (exactly_once, MASK_CREATION),
+        (exactly_once, PHOTOLITOGRAPHY),
+        (exactly_once, ION_IMPLANTATION),
+        (exactly_once, DICING),
+
+        (absence_2, TESTING),
+        (absence_2, SMART_TESTING),
+        (absence_2, QUALITY),
+        (absence_2, PACKAGING_COOLING),
+        (absence_2, PACKAGING),
+
+        (alt_succession, PICK_DESIGN, MASK_CREATION),
+        (alt_succession, PICK_SILICON, MASK_CREATION),
+        (alt_succession, PICK_IMPURITIES, MASK_CREATION),
+        (alt_succession, PICK_RESIST, MASK_CREATION),
+        (alt_succession, PICK_CHEMICALS, MASK_CREATION),
+
+        (alt_succession, MASK_CREATION, PHOTOLITOGRAPHY),
+        (alt_succession, PHOTOLITOGRAPHY, ION_IMPLANTATION),
+
+        (alt_precedence, ION_IMPLANTATION, TESTING),
+        (alt_precedence, ION_IMPLANTATION, SMART_TESTING),
+
+        (alt_succession, SMART_TESTING, QUALITY),
+
+        (alt_response, TESTING, DICING),
+        (alt_response, QUALITY, DICING),
+        (precedence_or, TESTING, QUALITY, DICING),
+
+        (alt_precedence, DICING, PACKAGING),
+        (alt_precedence, DICING, PACKAGING_COOLING),
+
+        (not_coexistence, TESTING, SMART_TESTING),
+        (not_coexistence, PACKAGING, PACKAGING_COOLING),
     ]
-    formula_str = " & ".join(map(lambda s: f"({s})", declare_constraints))
-    formula = pylogics.parsers.parse_ltl(formula_str)
-    automaton = logaut.core.ltl2dfa(formula, backend="lydia")
-    declare_automaton = from_symbolic_automaton_to_declare_automaton(automaton, ALL_SYMBOLS_SET)
+    if compiler == "compositional":
+        # explicit per-constraint DFAs over the simple alphabet, intersected and minimized
+        return declare_constraints_to_dfa(declare_constraints, ALL_SYMBOLS_SET)
+
+    declare_formulas = [template(*args) for template, *args in declare_constraints]
+    if compiler == "simple_alphabet":
+        # the "exactly one symbol per step" assumption is enforced by the DFA construction
+        formula_str = " & ".join(map(lambda s: f"({s})", declare_formulas))
+        return cached_dfa(
+            formula_str,
+            ALL_SYMBOLS_SET,
+            lambda: ltlf_to_simple_alphabet_dfa(formula_str, ALL_SYMBOLS_SET),
+        )
+    declare_formulas.append(build_declare_assumption(ALL_SYMBOLS_SET))
+    formula_str = " & ".join(map(lambda s: f"({s})", declare_formulas))
+
+    def compile_declare_automaton():
+        formula = pylogics.parsers.parse_ltl(formula_str)
+        automaton = logaut.core.ltl2dfa(formula, backend="lydia")
+        return from_symbolic_automaton_to_declare_automaton(automaton, ALL_SYMBOLS_SET)
+
+    # the DFA is compiled with Lydia only the first time, then read from the on-disk cache
+    declare_automaton = cached_dfa(formula_str, ALL_SYMBOLS_SET, compile_declare_automaton)
     return declare_automaton
 
@@ -8,6 +8,7 @@ setup(name='stochastic_service_composition',
       zip_safe=False,
       install_requires=[
             "numpy",
+            "scipy",
             "graphviz",
             "websockets",
             "paho-mqtt",
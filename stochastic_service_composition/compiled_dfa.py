@@ -0,0 +1,75 @@
+"""This module implements an array-backed representation of DFAs, for fast lookups."""
+from typing import Dict, List, Tuple
+
+import numpy as np
+from pythomata import SimpleDFA
+
+from stochastic_service_composition.types import State
+
+DEAD_STATE = -1
+
+
+class CompiledDFA:
+    """
+    A DFA with integer states and symbols.
+
+    States and symbols are identified by their index in the 'states' and
+    'symbols' tables; 'next_states[q, a]' is the successor of state q with
+    symbol a, or DEAD_STATE if the transition is not defined. The same table
+    is also available as nested lists ('next_state_rows'), which are faster
+    than NumPy for scalar lookups in Python loops.
+    """
+
+    def __init__(self, dfa: SimpleDFA):
+        """
+        Compile a DFA.
+
+        :param dfa: the DFA
+        """
+        transition_function = dfa.transition_function
+        accepting_states = dfa.accepting_states
+        self.states: List[State] = sorted(dfa.states, key=repr)
+        self.state_ids: Dict[State, int] = {
+            state: index for index, state in enumerate(self.states)
+        }
+        self.symbols: List[str] = sorted(dfa.alphabet, key=repr)
+        self.symbol_ids: Dict[str, int] = {
+            symbol: index for index, symbol in enumerate(self.symbols)
+        }
+        self.initial_state: int = self.state_ids[dfa.initial_state]
+
+        self.next_states = np.full(
+            (len(self.states), len(self.symbols)), DEAD_STATE, dtype=np.int64
+        )
+        for state, symbol_to_next_state in transition_function.items():
+            for symbol, next_state in symbol_to_next_state.items():
+                self.next_states[
+                    self.state_ids[state], self.symbol_ids[symbol]
+                ] = self.state_ids[next_state]
+        self.accepting = np.array(
+            [state in accepting_states for state in self.states], dtype=bool
+        ).reshape(len(self.states))
+
+        self.next_state_rows: List[List[int]] = self.next_states.tolist()
+        self.accepting_list: List[bool] = self.accepting.tolist()
+        self.enabled_symbols: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(np.flatnonzero(row != DEAD_STATE).tolist()) for row in self.next_states
+        )
+
+    @property
+    def nb_states(self) -> int:
+        """Get the number of states."""
+        return len(self.states)
+
+    @property
+    def nb_symbols(self) -> int:
+        """Get the number of symbols."""
+        return len(self.symbols)
+
+    def is_accepting(self, state: int) -> bool:
+        """Check whether a state (id) is accepting."""
+        return self.accepting_list[state]
+
+    def next_state(self, state: int, symbol: int) -> int:
+        """Get the successor of a state (id) with a symbol (id), or DEAD_STATE."""
+        return self.next_state_rows[state][symbol]
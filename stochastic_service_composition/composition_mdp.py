@@ -1,14 +1,42 @@
 """This module implements the algorithm to compute the system-target MDP."""
+import itertools
 import time
 from collections import deque
-from typing import Deque, Dict, List, Set, Tuple
-
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
+
+import numpy as np
+from mdp_dp_rl.processes.det_policy import DetPolicy
 from mdp_dp_rl.processes.mdp import MDP
 from pythomata import SimpleDFA
 
-from stochastic_service_composition.services import Service, build_system_service
+from stochastic_service_composition.compiled_dfa import CompiledDFA
+from stochastic_service_composition.services import (
+    Service,
+    SystemService,
+    build_system_service,
+)
+from stochastic_service_composition.solvers import (
+    DEFAULT_TOLERANCE,
+    SolverResult,
+    value_iteration,
+)
+from stochastic_service_composition.sparse_mdp import SparseMDP, SparseMDPBuilder
 from stochastic_service_composition.target import Target
-from stochastic_service_composition.types import Action, State, MDPDynamics
+from stochastic_service_composition.types import Action, Prob, Reward, State
 
 COMPOSITION_MDP_INITIAL_STATE = 0
 COMPOSITION_MDP_INITIAL_ACTION = "initial"
@@ -17,20 +45,27 @@ DEFAULT_GAMMA = 0.9
 
 COMPOSITION_MDP_SINK_STATE = -1
 
+COMP_MDP_SEEDING_INITIAL = "initial"
+COMP_MDP_SEEDING_ALL_IDLE = "all_idle"
+
 
 def composition_mdp(
-    target: Target, *services: Service, gamma: float = DEFAULT_GAMMA
-) -> MDP:
+    target: Target,
+    *services: Service,
+    gamma: float = DEFAULT_GAMMA,
+    sparse: bool = False,
+) -> Union[MDP, SparseMDP]:
     """
     Compute the composition MDP.
 
     :param target: the target service.
     :param services: the community of services.
     :param gamma: the discount factor.
+    :param sparse: if True, return the compact SparseMDP instead of an mdp_dp_rl MDP.
     :return: the composition MDP.
     """
 
-    system_service = build_system_service(*services)
+    system_service = build_system_service(*services, cache_size=0)
 
     initial_state = COMPOSITION_MDP_INITIAL_STATE
     # one action per service (1..n) + the initial action (0)
@@ -41,122 +76,255 @@ def composition_mdp(
     # add an 'undefined' action for sink states
     actions.add(COMPOSITION_MDP_UNDEFINED_ACTION)
 
-    transition_function: MDPDynamics = {}
-
-    visited = set()
-    to_be_visited = set()
-    queue: Deque = deque()
+    # the builder assigns an id to every discovered state;
+    # the queue contains the ids of the states to be visited
+    builder = SparseMDPBuilder()
+    queue: Deque[int] = deque()
 
     # add initial transitions
-    transition_function[initial_state] = {}
-    initial_transition_dist = {}
+    initial_state_id, _ = builder.add_state(initial_state)
+    initial_transition_dist: Dict[int, float] = {}
     symbols_from_initial_state = target.policy[target.initial_state].keys()
     for symbol in symbols_from_initial_state:
         next_state = (system_service.initial_state, target.initial_state, symbol)
         next_prob = target.policy[target.initial_state][symbol]
-        initial_transition_dist[next_state] = next_prob
-        queue.append(next_state)
-        to_be_visited.add(next_state)
-    transition_function[initial_state][initial_action] = (initial_transition_dist, 0.0)  # type: ignore
+        next_state_id, is_new = builder.add_state(next_state)
+        initial_transition_dist[next_state_id] = next_prob
+        if is_new:
+            queue.append(next_state_id)
+    builder.add_row(initial_state_id, initial_action, initial_transition_dist, 0.0)
 
     while len(queue) > 0:
-        current_state = queue.popleft()
-        to_be_visited.remove(current_state)
-        visited.add(current_state)
+        current_state_id = queue.popleft()
+        # the labels of the composition states are (system state, target state, symbol)
+        current_state = cast(Tuple[int, State, Action], builder.states[current_state_id])
         current_system_state, current_target_state, current_symbol = current_state
 
-        transition_function[current_state] = {}
-        # index system symbols (action, service_id) by symbol
-        system_symbols: List[Tuple[Action, int]] = list(
-            system_service.transition_function[current_system_state].keys()
-        )
-        system_symbols_by_symbols: Dict[Action, Set[int]] = {}
-        for action, service_id in system_symbols:
-            system_symbols_by_symbols.setdefault(action, set()).add(service_id)
-
-        for i in system_symbols_by_symbols.get(current_symbol, set()):
-            next_transitions = {}
+        has_transitions = False
+        # the services that can do the current symbol, from the action index of the system service
+        for i in system_service.enabled_services(current_system_state, current_symbol):
+            next_transitions: Dict[int, float] = {}
             # TODO check if it is needed
             if current_symbol not in target.transition_function[current_target_state]:
                 continue
-            next_reward = (
-                target.reward[current_target_state][current_symbol]
-                if (current_symbol, i)
-                in system_service.transition_function[current_system_state]
-                else 0
-            )
+            next_reward = target.reward[current_target_state][current_symbol]
             next_target_state = target.transition_function[current_target_state][
                 current_symbol
             ]
-            next_system_states, next_system_reward = system_service.transition_function[
-                current_system_state
-            ][(current_symbol, i)]
+            next_system_states, next_system_reward = system_service.successors(
+                current_system_state, current_symbol, i
+            )
             for next_symbol, next_prob in target.policy.get(next_target_state, {}).items():
                 for next_system_state, next_system_prob in next_system_states.items():
                     next_state = (next_system_state, next_target_state, next_symbol)
                     if next_prob * next_system_prob == 0.0:
                         continue
-                    next_transitions[next_state] = next_prob * next_system_prob
-                    if next_state not in visited and next_state not in to_be_visited:
-                        to_be_visited.add(next_state)
-                        queue.append(next_state)
-            transition_function[current_state][i] = (  # type: ignore
-                next_transitions,  # type: ignore
+                    next_state_id, is_new = builder.add_state(next_state)
+                    next_transitions[next_state_id] = next_prob * next_system_prob
+                    if is_new:
+                        queue.append(next_state_id)
+            builder.add_row(
+                current_state_id,
+                i,
+                next_transitions,
                 next_reward + next_system_reward,
             )
+            has_transitions = True
 
         # states without outgoing transitions are sink states.
         # add loop transitions with
         # - 'undefined' action
         # - probability 1
         # - reward 0
-        if len(transition_function[current_state]) == 0:
-            transition_function.setdefault(current_state, {})
-            transition_function[current_state][COMPOSITION_MDP_UNDEFINED_ACTION] = (
-                {current_state: 1.0},
+        if not has_transitions:
+            builder.add_row(
+                current_state_id,
+                COMPOSITION_MDP_UNDEFINED_ACTION,
+                {current_state_id: 1.0},
                 0.0,
-            )  # type: ignore
+            )
         # TODO check correctness
         # if next state distribution is empty, add loops
 
-    return MDP(transition_function, gamma)
+    # system states are encoded as integers; the encoder gives back the tuple view
+    result = builder.build(
+        gamma, initial_state=initial_state, state_encoder=system_service.encoder
+    )
+    return result if sparse else result.to_mdp()
 
 
 def comp_mdp(
-    dfa: SimpleDFA, services: Service, gamma: float = DEFAULT_GAMMA
-) -> MDP:
+    dfa: SimpleDFA,
+    services: Sequence[Service],
+    gamma: float = DEFAULT_GAMMA,
+    sparse: bool = False,
+    seeding: Union[str, Iterable[Sequence[State]]] = COMP_MDP_SEEDING_ALL_IDLE,
+    symmetry: bool = False,
+    partial_order: bool = False,
+) -> Union[MDP, SparseMDP]:
     """
     Compute the composition MDP.
 
-    :param target: the target service.
+    The exploration always starts from the initial state of the system service
+    and of the DFA; the seeding policy adds other start states, paired with the
+    initial state of the DFA:
+    - 'initial': none, only the states reachable from the initial state are explored;
+    - 'all_idle': every system state whose services are all idle ("re", "av" or "br");
+    - an iterable of system states, as tuples of local states.
+    The number of explored states is the number of states of the result.
+
+    With symmetry=True, identical services (same local states, dynamics and final
+    states) are interchangeable: the system states are replaced by their canonical
+    representative (see SystemService.canonicalize), and only one of the identical
+    services in the same local state is moved. The actions (symbol, service id) of
+    the result refer to the positions of the canonical state; use
+    'lift_symmetric_policy' to get the policy of the concrete states.
+
+    With partial_order=True, the independent tau moves are not interleaved (ample
+    set reduction): a tau move (an action not in the DFA alphabet) only changes
+    one service and leaves the DFA state unchanged, so it commutes with the moves
+    of the other services. If an allowed service is in a local state whose only
+    action is a deterministic tau move with reward 0 (e.g. checking or repairing
+    a service), that move is the only row of the state, unless it leads to an
+    already discovered state (cycle proviso). Taking the forced move first delays
+    the other rewards by one step, so the reduction preserves the optimal values
+    only without discounting: it requires gamma == 1. It is an undiscounted,
+    validation-only mode (e.g. to check the expected total reward of the
+    composition), not meant for the discounted experiments.
+
+    :param dfa: the DFA of the target specification.
     :param services: the community of services.
     :param gamma: the discount factor.
+    :param sparse: if True, return the compact SparseMDP instead of an mdp_dp_rl MDP.
+    :param seeding: the seeding policy of the exploration.
+    :param symmetry: if True, reduce the state space by the symmetries of identical services.
+    :param partial_order: if True, do not interleave the forced tau moves of the services (requires gamma == 1).
     :return: the composition MDP.
     """
+    assert not partial_order or gamma == 1.0, "the partial order reduction is exact only with gamma == 1"
     dfa = dfa.trim()
-    system_service = build_system_service(*services)
+    system_service = build_system_service(*services, cache_size=0)
+    explorer = _CompMDPExplorer(dfa, services, system_service, symmetry, partial_order)
+
+    # the initial state is the first start state, the seeds follow
+    initial_system_state, *seed_system_states = _seed_system_states(
+        system_service, seeding, explorer.canonical_state
+    )
+    initial_state = (initial_system_state, dfa.initial_state)
+    explorer.add_start_state(initial_system_state)
+    for system_service_state in seed_system_states:
+        explorer.add_start_state(system_service_state)
+    explorer.explore()
+
+    # system states are encoded as integers; the encoder gives back the tuple view
+    result = explorer.builder.build(
+        gamma,
+        initial_state=initial_state,
+        state_encoder=system_service.encoder,
+        symmetry_groups=system_service.symmetry_groups if symmetry else (),
+    )
+    return result if sparse else result.to_mdp()
+
+
+# a move of a service in comp_mdp:
+# (symbol, next DFA state id, goal reward, next local index distribution, service reward)
+_ServiceMove = Tuple[Action, int, float, Mapping[int, Prob], Reward]
+
+
+def _previous_symmetric_services(system_service: SystemService, symmetry: bool) -> List[Optional[int]]:
+    """
+    Get, for each service, the previous service of its symmetry group.
 
-    transition_function: MDPDynamics = {}
+    :param system_service: the system service
+    :param symmetry: whether the symmetries are used; if not, no service has a previous one
+    :return: the id of the previous service of the same symmetry group, or None, by service id
+    """
+    previous_symmetric_service: List[Optional[int]] = [None] * len(system_service.services)
+    if symmetry:
+        for group in system_service.symmetry_groups:
+            for previous_service_id, service_id in zip(group, group[1:]):
+                previous_symmetric_service[service_id] = previous_service_id
+    return previous_symmetric_service
 
-    visited = set()
-    to_be_visited = set()
-    queue: Deque = deque()
 
-    # add initial transitions
-    initial_state = (system_service.initial_state, dfa.initial_state)
-    queue.append(initial_state)
-    to_be_visited.add(initial_state)
-    # aggiungo gli stati del system service alla lista degli stati da visitare
-    for system_service_state in system_service.states:
-        if system_service_state == system_service.initial_state:
-            continue
-        # includo solo gli stati del system service che hanno come valore "re", "av" o "br" (solo ready/available e broken)
-        if not all(elem in ["re", "av", "br"] for elem in system_service_state):
-            continue
-        new_initial_state = (system_service_state, dfa.initial_state)
-        queue.append(new_initial_state)
-        to_be_visited.add(new_initial_state)
+def _forced_tau_moves(
+    system_service: SystemService, compiled_dfa: CompiledDFA
+) -> List[List[Optional[Tuple[Action, int]]]]:
+    """
+    Compute the forced tau moves of the local states of the services.
+
+    A forced tau move is the only action of a local state, deterministic, with reward 0,
+    and not in the DFA alphabet.
 
+    :param system_service: the system service
+    :param compiled_dfa: the compiled DFA of the target specification
+    :return: the forced tau move (symbol, next local index), or None, by service id and local index
+    """
+    forced_tau_moves: List[List[Optional[Tuple[Action, int]]]] = []
+    for local_dynamics in system_service.local_dynamics:
+        forced_tau_moves.append([])
+        for local_transitions in local_dynamics:
+            forced_tau_move = None
+            if len(local_transitions) == 1:
+                ((symbol, (next_local_indexes, reward)),) = local_transitions.items()
+                if (
+                    symbol not in compiled_dfa.symbol_ids
+                    and len(next_local_indexes) == 1
+                    and reward == 0.0
+                ):
+                    forced_tau_move = (symbol, cast(int, next(iter(next_local_indexes))))
+            forced_tau_moves[-1].append(forced_tau_move)
+    return forced_tau_moves
+
+
+def _seed_system_states(
+    system_service: SystemService,
+    seeding: Union[str, Iterable[Sequence[State]]],
+    canonical_state: Optional[Callable[[int], int]],
+) -> List[int]:
+    """
+    Compute the start system states of the exploration of comp_mdp.
+
+    :param system_service: the system service
+    :param seeding: the seeding policy of the exploration (see comp_mdp)
+    :param canonical_state: the canonical representative of a system state, if the symmetries are used
+    :return: the initial system state, followed by the seed system states
+    """
+    if seeding == COMP_MDP_SEEDING_INITIAL:
+        seed_system_states = []
+    elif seeding == COMP_MDP_SEEDING_ALL_IDLE:
+        # aggiungo gli stati del system service alla lista degli stati da visitare
+        # includo solo gli stati del system service che hanno come valore "re", "av" o "br"
+        # (solo ready/available e broken)
+        idle_local_indexes = [
+            [index for index, elem in enumerate(local_states) if elem in ["re", "av", "br"]]
+            for local_states in system_service.local_states
+        ]
+        seed_system_states = [
+            system_service.encoder.encode_indexes(local_indexes)
+            for local_indexes in itertools.product(*idle_local_indexes)
+        ]
+    else:
+        assert not isinstance(seeding, str), f"unknown seeding policy: {seeding}"
+        seed_system_states = [system_service.encode(state) for state in seeding]
+    system_states = [system_service.initial_state, *seed_system_states]
+    if canonical_state is not None:
+        system_states = [canonical_state(state) for state in system_states]
+    return system_states
+
+
+def _dfa_state_tables(
+    dfa: SimpleDFA, services: Sequence[Service], compiled_dfa: CompiledDFA
+) -> Tuple[List[Tuple[int, ...]], List[Dict[Action, Tuple[int, float]]]]:
+    """
+    Compute the allowed services and the DFA moves, that only depend on the DFA state.
+
+    :param dfa: the DFA of the target specification
+    :param services: the community of services
+    :param compiled_dfa: the compiled DFA
+    :return: by DFA state id, the ids of the services that can do one of the next DFA actions (sorted),
+      and the enabled symbols, mapped to (next DFA state id, goal reward)
+    """
     # json con id del servizio e azione che può fare
     # es. {0: {'p_d'}, 1: {'p_s'}, 2: {'cr_m'}, stop_state: {'cr_m'}, 4: {'ph_l'}}
     service_id_to_target_action = {
@@ -166,92 +334,426 @@ def comp_mdp(
 
     # json con azione target e id dei servizi che possono eseguirla
     # es. {'p_d': {0}, 'p_s': {1}, 'cr_m': {2, 3}, 'ph_l': {4}}
-    target_action_to_service_id = {}
+    target_action_to_service_id: Dict[Action, Set[int]] = {}
     for service_id, supported_actions in service_id_to_target_action.items():
         # controllo che l'attore può fare solo un'azione
         assert len(supported_actions) == 1
         supported_action = list(supported_actions)[0]
         target_action_to_service_id.setdefault(supported_action, set()).add(service_id)
 
-    mdp_sink_state_used = False
-    # per ogni stato che devo visitare
-    while len(queue) > 0:
-        cur_state = queue.popleft()
-        to_be_visited.remove(cur_state)
-        visited.add(cur_state)
-
-        cur_system_state, cur_dfa_state = cur_state
-        trans_dist = {}
-
-        # ricavo le transition del system service dallo stato corrente
-        next_system_state_trans = system_service.transition_function[
-            cur_system_state
-        ].items()
-        
-        # optimization: filter services, consider only the ones that can do the next DFA action
-        # ricavo le azioni che il DFA può fare dallo stato corrente
-        next_dfa_actions = set(dfa.transition_function.get(cur_dfa_state, {}).keys())
-        
-        # ricavo solo i servizi che possono fare l'azione successiva
-        allowed_services = set()
-        for next_dfa_action in next_dfa_actions:
-            allowed_services.update(target_action_to_service_id[next_dfa_action])
-        
-        if len(allowed_services) == 0:
-            mdp_sink_state_used = True
-            trans_dist[COMPOSITION_MDP_UNDEFINED_ACTION] = ({COMPOSITION_MDP_SINK_STATE: 1}, 0.0)
-        else:
-            # iterate over all available actions of system service
-            # in case symbol is in DFA available actions, progress DFA state component
-            # es. ('ph_l', 4) -> ({('re', 're', 're', 're', 'do'): 0.95, ('re', 're', 're', 're', 'br'): 0.05}, -1.0)
-            for (symbol, service_id), next_state_info in next_system_state_trans:
-
-                if service_id not in allowed_services:
-                    # this service id cannot do any of the next dfa actions
-                    continue
-
-                # es. ({('re', 're', 're', 're', 'do'): 0.95, ('re', 're', 're', 're', 'br'): 0.05}, -1.0)
-                next_system_state_distr, reward_vector = next_state_info
-                system_reward = reward_vector   # es. -1.0
-
-                # if symbol is a tau action, next dfa state remains the same
-                if symbol not in dfa.alphabet:
-                    next_dfa_state = cur_dfa_state
-                    goal_reward = 0.0
-                # if there are no outgoing transitions from DFA state:
-                elif cur_dfa_state not in dfa.transition_function:
-                    mdp_sink_state_used = True
-                    trans_dist[COMPOSITION_MDP_UNDEFINED_ACTION] = ({COMPOSITION_MDP_SINK_STATE: 1}, 0.0)
-                    continue
-                # symbols not in the transition function of the target
-                # are considered as "other"; however, when we add the
-                # MDP transition, we will label it with the original
-                # symbol.
-                elif symbol in dfa.transition_function[cur_dfa_state]:
-                    symbol_to_next_dfa_states = dfa.transition_function[cur_dfa_state]
-                    next_dfa_state = symbol_to_next_dfa_states[symbol]
-                    goal_reward = 1.0 if dfa.is_accepting(next_dfa_state) else 0.0
-                else:
-                    # if invalid target action, skip
-                    continue
+    allowed_services_by_dfa_state: List[Tuple[int, ...]] = []
+    dfa_moves_by_dfa_state: List[Dict[Action, Tuple[int, float]]] = []
+    for dfa_state_id, enabled_symbols in enumerate(compiled_dfa.enabled_symbols):
+        dfa_state_services: Set[int] = set()
+        dfa_moves: Dict[Action, Tuple[int, float]] = {}
+        for symbol_id in enabled_symbols:
+            symbol = compiled_dfa.symbols[symbol_id]
+            dfa_state_services.update(target_action_to_service_id[symbol])
+            next_dfa_state_id = compiled_dfa.next_state_rows[dfa_state_id][symbol_id]
+            dfa_moves[symbol] = (next_dfa_state_id, 1.0 if compiled_dfa.accepting_list[next_dfa_state_id] else 0.0)
+        allowed_services_by_dfa_state.append(tuple(sorted(dfa_state_services)))
+        dfa_moves_by_dfa_state.append(dfa_moves)
+    return allowed_services_by_dfa_state, dfa_moves_by_dfa_state
+
+
+class _CompMDPExplorer:
+    """The breadth-first exploration of the states of comp_mdp."""
+
+    def __init__(
+        self,
+        dfa: SimpleDFA,
+        services: Sequence[Service],
+        system_service: SystemService,
+        symmetry: bool,
+        partial_order: bool,
+    ):
+        """
+        Initialize the exploration.
+
+        :param dfa: the (trimmed) DFA of the target specification
+        :param services: the community of services
+        :param system_service: the system service of the community
+        :param symmetry: whether to reduce the state space by the symmetries of identical services
+        :param partial_order: whether to reduce the state space by the forced tau moves
+        """
+        self.dfa = dfa
+        self.system_service = system_service
+        # states and symbols of the DFA as integers, with a dense transition table
+        self.compiled_dfa = CompiledDFA(dfa)
+        self.canonical_state = system_service.canonical_state if symmetry else None
+        self.previous_symmetric_service = _previous_symmetric_services(system_service, symmetry)
+        self.forced_tau_moves = _forced_tau_moves(system_service, self.compiled_dfa) if partial_order else None
+        self.allowed_services_by_dfa_state, self.dfa_moves_by_dfa_state = _dfa_state_tables(
+            dfa, services, self.compiled_dfa
+        )
+        # (DFA state id, service id, local state index) -> moves of the service;
+        # the distributions are the interned ones of the system service, they are not copied
+        self.service_moves_cache: Dict[Tuple[int, int, int], List[_ServiceMove]] = {}
+        # the builder assigns an id to every discovered state;
+        # the queue contains the ids of the states to be visited, with the id of their DFA state
+        self.builder = SparseMDPBuilder()
+        self.queue: Deque[Tuple[int, int]] = deque()
+
+    def add_start_state(self, system_state: int) -> None:
+        """Add a start state of the exploration, with the initial state of the DFA."""
+        state_id, is_new = self.builder.add_state((system_state, self.dfa.initial_state))
+        if is_new:
+            self.queue.append((state_id, self.compiled_dfa.initial_state))
+
+    def explore(self) -> None:
+        """Visit all the states reachable from the start states, adding their rows."""
+        builder = self.builder
+        sink_state_id: Optional[int] = None
+        # per ogni stato che devo visitare
+        while len(self.queue) > 0:
+            cur_state_id, cur_dfa_state_id = self.queue.popleft()
+            # optimization: filter services, consider only the ones that can do the next DFA action
+            allowed_services = self.allowed_services_by_dfa_state[cur_dfa_state_id]
+            if len(allowed_services) == 0:
+                sink_state_id = builder.add_state(COMPOSITION_MDP_SINK_STATE)[0]
+                builder.add_row(cur_state_id, COMPOSITION_MDP_UNDEFINED_ACTION, {sink_state_id: 1.0}, 0.0)
+                continue
+            if self.forced_tau_moves is not None:
+                allowed_services = self._ample_services(cur_state_id, allowed_services)
+            for action, (next_state_ids, reward) in self._transitions(
+                cur_state_id, cur_dfa_state_id, allowed_services
+            ).items():
+                builder.add_row(cur_state_id, action, next_state_ids, reward)
+
+        if sink_state_id is not None:
+            builder.add_row(sink_state_id, COMPOSITION_MDP_UNDEFINED_ACTION, {sink_state_id: 1.0}, 0.0)
+
+    def _transitions(
+        self, state_id: int, dfa_state_id: int, allowed_services: Tuple[int, ...]
+    ) -> Dict[Action, Tuple[Dict[int, float], float]]:
+        """
+        Compute the rows of a state, discovering its successors.
+
+        :param state_id: the id of the composition state
+        :param dfa_state_id: the id of its DFA state
+        :param allowed_services: the services to move
+        :return: the map (symbol, service id) -> (next state ids distribution, reward)
+        """
+        system_service = self.system_service
+        # the labels of the composition states are (system state, DFA state)
+        system_state = cast(Tuple[int, State], self.builder.states[state_id])[0]
+        trans_dist: Dict[Action, Tuple[Dict[int, float], float]] = {}
+        # iterate over the available actions of the allowed services only
+        # in case symbol is in DFA available actions, progress DFA state component
+        # es. ('ph_l', 4) -> ({('re', 're', 're', 're', 'do'): 0.95, ('re', 're', 're', 're', 'br'): 0.05}, -1.0)
+        for service_id in allowed_services:
+            local_index = system_service.local_index(system_state, service_id)
+            # in a canonical state, identical services in the same local state are adjacent:
+            # they have the same moves, only the first one is kept
+            previous_service_id = self.previous_symmetric_service[service_id]
+            if previous_service_id is not None and local_index == system_service.local_index(
+                system_state, previous_service_id
+            ):
+                continue
+            # the next system states only differ from the current one in the moved service
+            stride = system_service.encoder.strides[service_id]
+            base_system_state = system_state - local_index * stride
+            for symbol, next_dfa_state_id, goal_reward, next_local_indexes, system_reward in self._service_moves(
+                dfa_state_id, service_id, local_index
+            ):
                 final_rewards = (goal_reward + system_reward)
+                next_state_distr = trans_dist.setdefault((symbol, service_id), ({}, final_rewards))[0]
+                self._add_successors(
+                    next_state_distr, base_system_state, stride, next_local_indexes, next_dfa_state_id
+                )
+        return trans_dist
+
+    def _add_successors(
+        self,
+        next_state_distr: Dict[int, float],
+        base_system_state: int,
+        stride: int,
+        next_local_indexes: Mapping[int, Prob],
+        next_dfa_state_id: int,
+    ) -> None:
+        """
+        Add the successors of a move of a service to a next states distribution.
+
+        :param next_state_distr: the next state ids distribution, updated in place
+        :param base_system_state: the system state, with the local index of the moved service set to 0
+        :param stride: the stride of the moved service
+        :param next_local_indexes: the next local indexes distribution of the moved service
+        :param next_dfa_state_id: the id of the next DFA state
+        """
+        next_dfa_state = self.compiled_dfa.states[next_dfa_state_id]
+        canonical_state = self.canonical_state
+        for next_local_index, prob in next_local_indexes.items():
+            next_system_state = base_system_state + next_local_index * stride
+            if canonical_state is not None:
+                next_system_state = canonical_state(next_system_state)
+            next_state_id, is_new = self.builder.add_state((next_system_state, next_dfa_state))
+            # different successors can have the same canonical state
+            next_state_distr[next_state_id] = next_state_distr.get(next_state_id, 0.0) + prob
+            if is_new:
+                self.queue.append((next_state_id, next_dfa_state_id))
+
+    def _service_moves(self, dfa_state_id: int, service_id: int, local_index: int) -> List[_ServiceMove]:
+        """
+        Get the moves of a service in a local state, from a DFA state.
+
+        :param dfa_state_id: the DFA state id
+        :param service_id: the service id
+        :param local_index: the local state index of the service
+        :return: the moves of the service
+        """
+        service_moves_key = (dfa_state_id, service_id, local_index)
+        service_moves = self.service_moves_cache.get(service_moves_key)
+        if service_moves is not None:
+            return service_moves
+        service_moves = []
+        dfa_moves = self.dfa_moves_by_dfa_state[dfa_state_id]
+        local_transitions = self.system_service.local_transitions(service_id, local_index)
+        for symbol, (next_local_indexes, system_reward) in local_transitions.items():
+            # the local dynamics of the system service are over local indexes
+            next_local_index_distribution = cast(Mapping[int, Prob], next_local_indexes)
+            # if symbol is a tau action, next dfa state remains the same
+            if symbol not in self.compiled_dfa.symbol_ids:
+                service_moves.append((symbol, dfa_state_id, 0.0, next_local_index_distribution, system_reward))
+            elif symbol in dfa_moves:
+                service_moves.append((symbol, *dfa_moves[symbol], next_local_index_distribution, system_reward))
+            # otherwise, it is an invalid target action: skip it
+        self.service_moves_cache[service_moves_key] = service_moves
+        return service_moves
+
+    def _ample_services(self, state_id: int, allowed_services: Tuple[int, ...]) -> Tuple[int, ...]:
+        """
+        Get the ample set of services of a state.
+
+        :param state_id: the id of the composition state
+        :param allowed_services: the services that can move in the DFA state
+        :return: the first allowed service with a forced tau move to a new state, if any; otherwise, all of them
+        """
+        system_service = self.system_service
+        forced_tau_moves = cast(List[List[Optional[Tuple[Action, int]]]], self.forced_tau_moves)
+        system_state, dfa_state = cast(Tuple[int, State], self.builder.states[state_id])
+        for service_id in allowed_services:
+            forced_tau_move = forced_tau_moves[service_id][system_service.local_index(system_state, service_id)]
+            if forced_tau_move is None:
+                continue
+            next_system_state = system_service.encoder.replace(system_state, service_id, forced_tau_move[1])
+            if self.canonical_state is not None:
+                next_system_state = self.canonical_state(next_system_state)
+            # cycle proviso: the forced tau move must lead to a new state
+            if (next_system_state, dfa_state) not in self.builder.state_index:
+                return (service_id,)
+        return allowed_services
+
+
+def lift_symmetric_policy(
+    policy: DetPolicy, services: Sequence[Service], states: Optional[Iterable[State]] = None
+) -> DetPolicy:
+    """
+    Map a policy of a symmetry-reduced composition MDP to concrete states.
 
-                for next_system_state, prob in next_system_state_distr.items():
-                    assert prob > 0.0
-                    next_state = (next_system_state, next_dfa_state)
-                    trans_dist.setdefault((symbol, service_id), ({}, final_rewards))[0][
-                        next_state
-                    ] = prob
-                    if next_state not in visited and next_state not in to_be_visited:
-                        queue.append(next_state)
-                        to_be_visited.add(next_state)
+    Each concrete state (system state, DFA state) is mapped to its canonical
+    state; the action (symbol, k) of the canonical state moves the service in
+    position k, i.e. the concrete service permutation[k].
 
-        transition_function[cur_state] = trans_dist
+    :param policy: the policy of the MDP built by comp_mdp with symmetry=True
+    :param services: the community of services, in the same order
+    :param states: the concrete states of interest (e.g. the visited ones); if None,
+      all the concrete states symmetric to the states of the policy
+    :return: the policy of the concrete states
+    """
+    system_service = build_system_service(*services, cache_size=0)
+    if states is None:
+        states = _symmetric_states(system_service, policy.get_state_to_action_map())
+    policy_data: Dict[State, Action] = {}
+    for state in states:
+        if state == COMPOSITION_MDP_SINK_STATE:
+            policy_data[state] = COMPOSITION_MDP_UNDEFINED_ACTION
+            continue
+        system_state, dfa_state = cast(Tuple[int, State], state)
+        canonical_system_state, permutation = system_service.canonicalize(system_state)
+        action = policy.get_action_for_state((canonical_system_state, dfa_state))
+        if isinstance(action, tuple):
+            symbol, position = action
+            action = (symbol, permutation[position])
+        policy_data[state] = action
+    return DetPolicy(policy_data)
 
-    if mdp_sink_state_used:
-        transition_function[COMPOSITION_MDP_SINK_STATE] = {COMPOSITION_MDP_UNDEFINED_ACTION: ({COMPOSITION_MDP_SINK_STATE: 1.0}, 0.0)}
 
-    result = MDP(transition_function, gamma)
-    result.initial_state = initial_state
-    return result
+def _symmetric_states(system_service: SystemService, canonical_states: Iterable[State]) -> Iterator[State]:
+    """
+    Enumerate the concrete states of a symmetry-reduced composition MDP.
+
+    :param system_service: the system service
+    :param canonical_states: the states of the symmetry-reduced composition MDP
+    :return: the concrete states with the same canonical state
+    """
+    for state in canonical_states:
+        if state == COMPOSITION_MDP_SINK_STATE:
+            yield state
+            continue
+        system_state, dfa_state = cast(Tuple[int, State], state)
+        for symmetric_system_state in system_service.symmetric_states(system_state):
+            yield symmetric_system_state, dfa_state
+
+
+def _service_transition(state, action) -> Optional[Tuple[int, Action, int]]:
+    """
+    Get the system service transition of a composition MDP row.
+
+    :param state: the composition state
+    :param action: the composition action
+    :return: the triple (system state, symbol, service id), or None if the row does not move a service
+    """
+    # comp_mdp: states (system_state, dfa_state), actions (symbol, service_id)
+    if isinstance(action, tuple):
+        symbol, service_id = action
+        return state[0], symbol, service_id
+    # composition_mdp: states (system_state, target_state, symbol), actions service_id
+    if isinstance(action, int) and isinstance(state, tuple):
+        return state[0], state[2], action
+    return None
+
+
+def _service_rows(
+    mdp: SparseMDP, service_id: Optional[int] = None
+) -> Iterator[Tuple[int, int, State, Action]]:
+    """
+    Iterate over the rows of a composition MDP that move a service.
+
+    :param mdp: the sparse composition MDP (built with sparse=True)
+    :param service_id: if not None, only the rows that move this service
+    :return: the tuples (row, service id, local state of the service, symbol)
+    """
+    encoder = mdp.state_encoder
+    assert encoder is not None, "the MDP has no state encoder"
+    # a row of a canonical state stands for the moves of all the identical services
+    assert len(mdp.symmetry_groups) == 0, "the MDP is symmetry-reduced"
+    # a macro-row moves the services of a whole chain of forced states
+    assert mdp.row_steps is None, "the MDP has rows of several steps (e.g. compress_chains)"
+    action_ids = [
+        action_id
+        for action_id, action in enumerate(mdp.actions)
+        if service_id is None
+        or (isinstance(action, tuple) and action[1] == service_id)
+        or (isinstance(action, int) and action == service_id)
+    ]
+    rows = np.flatnonzero(np.isin(mdp.row_actions, action_ids))
+    row_states = mdp.row_states()
+    for row in rows.tolist():
+        transition = _service_transition(
+            mdp.states[row_states[row]], mdp.actions[mdp.row_actions[row]]
+        )
+        if transition is None:
+            continue
+        system_state, symbol, row_service_id = transition
+        local_state = encoder.decode_local(
+            row_service_id, encoder.component(system_state, row_service_id)
+        )
+        yield row, row_service_id, local_state, symbol
 
+
+def update_service(
+    mdp: SparseMDP, services: Sequence[Service], service_id: int, new_service: Service
+) -> np.ndarray:
+    """
+    Patch, in place, the rows of a composition MDP after a change of a service.
+
+    Only the probabilities and the rewards of the service can change: the new
+    service must have the same states and transitions, and every next-state
+    distribution must have the same support as before (or a subset of it, in
+    which case the removed successors are kept with probability zero).
+
+    Since every composition row moves exactly one service, its probabilities
+    are rescaled by new_prob / old_prob and its reward is shifted by
+    new_reward - old_reward, which works both for the MDPs of 'composition_mdp'
+    and of 'comp_mdp'. It does not hold for the symmetry-reduced MDPs and for the
+    compressed ones (see 'compress_chains'), which are rejected.
+
+    :param mdp: the sparse composition MDP (built with sparse=True)
+    :param services: the community of services used to build the MDP
+    :param service_id: the index of the changed service
+    :param new_service: the new version of the service
+    :return: the indexes of the patched rows
+    """
+    encoder = mdp.state_encoder
+    assert encoder is not None, "the MDP has no state encoder"
+    old_service = services[service_id]
+    assert (
+        old_service.states == new_service.states
+    ), "the states of the service cannot change"
+
+    rows = []
+    for row, _, local_state, symbol in _service_rows(mdp, service_id):
+        rows.append(row)
+        old_distribution, old_reward = old_service.transition_function[local_state][symbol]
+        new_distribution, new_reward = new_service.transition_function[local_state][symbol]
+        assert set(new_distribution).issubset(
+            old_distribution
+        ), f"the successors of {local_state} with {symbol} cannot change"
+        mdp.rewards[row] += new_reward - old_reward
+        for entry in range(mdp.row_ptr[row], mdp.row_ptr[row + 1]):
+            next_state = mdp.states[mdp.next_states[entry]]
+            next_local_state = encoder.decode_local(
+                service_id, encoder.component(next_state[0], service_id)
+            )
+            mdp.probs[entry] *= (
+                new_distribution.get(next_local_state, 0.0)
+                / old_distribution[next_local_state]
+            )
+    return np.array(rows, dtype=np.int64)
+
+
+def resolve_after_update(
+    result: SolverResult,
+    services: Sequence[Service],
+    service_id: int,
+    new_service: Service,
+    tol: float = DEFAULT_TOLERANCE,
+    max_iterations: Optional[int] = None,
+) -> SolverResult:
+    """
+    Update a service of a solved composition MDP, and solve it again.
+
+    The MDP of the result is patched in place with 'update_service', and value
+    iteration starts from the previous values, which are typically close to the
+    new ones after a small change of probabilities or rewards.
+
+    :param result: the result of a sparse solver on the composition MDP
+    :param services: the community of services used to build the MDP
+    :param service_id: the index of the changed service
+    :param new_service: the new version of the service
+    :param tol: the tolerance on the maximum value change
+    :param max_iterations: the maximum number of iterations (no limit if None)
+    :return: the new result
+    """
+    update_service(result.mdp, services, service_id, new_service)
+    return value_iteration(
+        result.mdp, tol, max_iterations=max_iterations, initial_values=result.values
+    )
+
+
+def scenario_rewards(
+    mdp: SparseMDP, services: Sequence[Service], scenarios: Sequence[Sequence[Service]]
+) -> np.ndarray:
+    """
+    Compute the rewards of a composition MDP for several variants of its community.
+
+    Each scenario is a community with the same services as 'services' up to
+    their rewards (e.g. the costs of another country); the rewards of the
+    target and of the goal are kept. The result can be solved at once with
+    'batched_value_iteration'.
+
+    :param mdp: the sparse composition MDP (built with sparse=True)
+    :param services: the community of services used to build the MDP
+    :param scenarios: the communities of the scenarios
+    :return: the rewards, an array of shape (number of rows, number of scenarios)
+    """
+    assert all(
+        len(scenario) == len(services) for scenario in scenarios
+    ), "every scenario must have the same number of services"
+    rewards = np.repeat(mdp.rewards[:, np.newaxis], len(scenarios), axis=1)
+    for row, service_id, local_state, symbol in _service_rows(mdp):
+        old_reward = services[service_id].transition_function[local_state][symbol][1]
+        for k, scenario in enumerate(scenarios):
+            new_reward = scenario[service_id].transition_function[local_state][symbol][1]
+            rewards[row, k] += new_reward - old_reward
+    return rewards
@@ -64,3 +64,34 @@ def build_declare_assumption(all_symbols: Set[str]) -> str:
         at_most_one_subformulas.append(subformula)
     at_most_one = " & ".join(at_most_one_subformulas)
     return f"{at_least_one} & {at_most_one}"
+
+
+# Explicit DFAs of the templates over the simple alphabet, i.e. exactly one symbol holds at each step.
+# The letters of a template DFA are the positions of its arguments, plus a last letter that
+# stands for any other symbol; the initial state is 0, and transitions[state][letter] is the
+# next state. The DFAs are complete and minimal.
+# Each entry is (accepting, transitions).
+TEMPLATE_DFAS = {
+    # 0: no a, 1: one a, 2: sink
+    "absence_2": ((True, True, False), ((1, 0), (2, 1), (2, 2))),
+    # 0: no a, 1: one a, 2: sink
+    "exactly_once": ((False, True, False), ((1, 0), (2, 1), (2, 2))),
+    # 0: no a yet, 1: a seen, 2: sink
+    "precedence": ((True, True, False), ((1, 2, 0), (1, 1, 1), (2, 2, 2))),
+    # 0: no a1/a2 yet, 1: a1 or a2 seen, 2: sink
+    "precedence_or": (
+        (True, True, False),
+        ((1, 1, 2, 0), (1, 1, 1, 1), (2, 2, 2, 2)),
+    ),
+    # 0: no pending a, 1: pending a, 2: sink
+    "alt_response": ((True, False, False), ((1, 0, 0), (2, 0, 1), (2, 2, 2))),
+    # 0: a needed before the next b, 1: a seen, 2: sink
+    "alt_precedence": ((True, True, False), ((1, 2, 0), (1, 0, 1), (2, 2, 2))),
+    # 0: a needed before the next b, 1: pending a, 2: sink
+    "alt_succession": ((True, False, False), ((1, 2, 0), (2, 0, 1), (2, 2, 2))),
+    # 0: neither a nor b, 1: a seen, 2: b seen, 3: sink
+    "not_coexistence": (
+        (True, True, True, False),
+        ((1, 2, 0), (1, 3, 1), (3, 2, 2), (3, 3, 3)),
+    ),
+}
@@ -0,0 +1,155 @@
+"""This module implements an on-disk, content-addressed cache of compiled DFAs."""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Collection, Dict, Optional, Union
+
+import numpy as np
+from pythomata import SimpleDFA
+
+DFA_CACHE_DIR_ENV = "SSC_DFA_CACHE_DIR"
+DEFAULT_DFA_CACHE_DIR = Path.home() / ".cache" / "stochastic_service_composition" / "dfa"
+
+# bump when the compilation pipeline or the file format changes
+DFA_CACHE_FORMAT_VERSION = 1
+
+_NO_TRANSITION = -1
+
+
+def normalize_formula(formula: str) -> str:
+    """Normalize the whitespaces of a formula string."""
+    return " ".join(formula.split())
+
+
+def dfa_cache_key(formula: str, alphabet: Collection[str]) -> str:
+    """
+    Compute the cache key of a formula over an alphabet.
+
+    :param formula: the formula string
+    :param alphabet: the symbols of the DFA
+    :return: the hexadecimal SHA-256 digest
+    """
+    content = json.dumps(
+        {
+            "version": DFA_CACHE_FORMAT_VERSION,
+            "formula": normalize_formula(formula),
+            "alphabet": sorted(alphabet),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def save_dfa(dfa: SimpleDFA, path: Union[str, Path]) -> None:
+    """
+    Save a DFA in a compact binary form.
+
+    The states are stored as integers (their label if they are all integers,
+    otherwise their position), the transition function as a dense
+    |states| x |alphabet| table, with -1 for missing transitions.
+
+    :param dfa: the DFA
+    :param path: the path of the file
+    """
+    states = sorted(dfa.states, key=repr)
+    if all(isinstance(state, int) and not isinstance(state, bool) for state in states):
+        labels = np.array(states, dtype=np.int64)
+    else:
+        labels = np.arange(len(states), dtype=np.int64)
+    state_ids = {state: i for i, state in enumerate(states)}
+    alphabet = sorted(dfa.alphabet)
+    symbol_ids = {symbol: i for i, symbol in enumerate(alphabet)}
+
+    transitions = np.full((len(states), len(alphabet)), _NO_TRANSITION, dtype=np.int32)
+    for state, symbol_to_next_state in dfa.transition_function.items():
+        for symbol, next_state in symbol_to_next_state.items():
+            transitions[state_ids[state], symbol_ids[symbol]] = state_ids[next_state]
+    accepting = np.zeros(len(states), dtype=bool)
+    accepting[[state_ids[state] for state in dfa.accepting_states]] = True
+
+    with open(path, "wb") as f:
+        np.savez_compressed(
+            f,
+            labels=labels,
+            alphabet=np.array(alphabet, dtype=np.str_),
+            initial_state=np.int64(state_ids[dfa.initial_state]),
+            accepting=accepting,
+            transitions=transitions,
+        )
+
+
+def load_dfa(path: Union[str, Path]) -> SimpleDFA:
+    """
+    Load a DFA saved with 'save_dfa'.
+
+    :param path: the path of the file
+    :return: the DFA
+    """
+    with np.load(path, allow_pickle=False) as data:
+        labels = data["labels"].tolist()
+        alphabet = data["alphabet"].tolist()
+        initial_state = int(data["initial_state"])
+        accepting = data["accepting"]
+        transitions = data["transitions"].tolist()
+
+    transition_function: Dict[int, Dict[str, int]] = {}
+    for state_id, row in enumerate(transitions):
+        for symbol, next_state_id in zip(alphabet, row):
+            if next_state_id != _NO_TRANSITION:
+                transition_function.setdefault(labels[state_id], {})[symbol] = labels[
+                    next_state_id
+                ]
+    return SimpleDFA(
+        set(labels),
+        set(alphabet),
+        labels[initial_state],
+        {labels[state_id] for state_id in np.flatnonzero(accepting).tolist()},
+        transition_function,
+    )
+
+
+def cached_dfa(
+    formula: str,
+    alphabet: Collection[str],
+    compile_dfa: Callable[[], SimpleDFA],
+    cache_dir: Optional[Union[str, Path]] = None,
+) -> SimpleDFA:
+    """
+    Get the DFA of a formula from the cache, or compile and store it.
+
+    The DFA is addressed by the hash of the normalized formula and of the
+    alphabet. The DFA is always returned as read back from its compact form,
+    so cache hits and misses give the same DFA.
+
+    :param formula: the formula string
+    :param alphabet: the symbols of the DFA
+    :param compile_dfa: the function that compiles the DFA on a cache miss
+    :param cache_dir: the cache directory; if None, the directory in the environment
+      variable SSC_DFA_CACHE_DIR, or ~/.cache/stochastic_service_composition/dfa
+    :return: the DFA
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(DFA_CACHE_DIR_ENV, DEFAULT_DFA_CACHE_DIR)
+    cache_dir = Path(cache_dir)
+    path = cache_dir / f"{dfa_cache_key(formula, alphabet)}.npz"
+    if path.is_file():
+        try:
+            return load_dfa(path)
+        except (OSError, ValueError, KeyError):
+            # corrupted entry: compile it again
+            pass
+
+    dfa = compile_dfa()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file and rename it, so concurrent readers never see partial files
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        save_dfa(dfa, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return load_dfa(path)
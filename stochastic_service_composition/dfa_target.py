@@ -1,18 +1,94 @@
 """Represent a target service."""
 from collections import deque
-from typing import Any, Mapping, Set, Tuple, Deque
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Set, Tuple, Deque, Union, cast
 
+import numpy as np
+from logaut import ltl2dfa
 from mdp_dp_rl.processes.mdp import MDP
 from mdp_dp_rl.utils.generic_typevars import A, S
 from pythomata import SimpleDFA
 from pythomata.core import DFA
 from pythomata.impl.symbolic import SymbolicDFA
-from sympy.logic.boolalg import BooleanTrue
+from pylogics.parsers import parse_ltl
+from sympy import Symbol
+from sympy.logic.boolalg import And, Boolean, BooleanFalse, BooleanTrue, Not, Or
 
 from stochastic_service_composition.constants import DEFAULT_GAMMA
+from stochastic_service_composition.declare_utils import TEMPLATE_DFAS
 from stochastic_service_composition.types import MDPDynamics
 
 
+class _OneHotGuards:
+    """
+    Evaluate the guards of a symbolic DFA on the one-hot interpretations of an alphabet.
+
+    Each guard is compiled once into a boolean mask over the symbol indexes:
+    the i-th entry tells whether the guard holds when only the i-th symbol is
+    true (atoms not in the alphabet are false).
+    """
+
+    def __init__(self, alphabet: Sequence[str]):
+        """
+        Initialize the evaluator.
+
+        :param alphabet: the symbols, in the order of the masks
+        """
+        self.alphabet = alphabet
+        self.symbol_indexes = {symbol: index for index, symbol in enumerate(alphabet)}
+        self._masks: Dict[Boolean, np.ndarray] = {}
+
+    def mask(self, guard: Boolean) -> np.ndarray:
+        """Get the mask of the symbols that satisfy a guard (memoized)."""
+        result = self._masks.get(guard)
+        if result is None:
+            result = self._compile(guard)
+            self._masks[guard] = result
+        return result
+
+    def _compile(self, guard: Boolean) -> np.ndarray:
+        """Compile a guard into a mask."""
+        nb_symbols = len(self.alphabet)
+        if isinstance(guard, BooleanTrue):
+            return np.ones(nb_symbols, dtype=bool)
+        if isinstance(guard, BooleanFalse):
+            return np.zeros(nb_symbols, dtype=bool)
+        if isinstance(guard, Symbol):
+            result = np.zeros(nb_symbols, dtype=bool)
+            index = self.symbol_indexes.get(guard.name)
+            if index is not None:
+                result[index] = True
+            return result
+        if isinstance(guard, Not):
+            return ~self.mask(guard.args[0])
+        if isinstance(guard, And):
+            return np.logical_and.reduce([self.mask(arg) for arg in guard.args])
+        if isinstance(guard, Or):
+            return np.logical_or.reduce([self.mask(arg) for arg in guard.args])
+        # other connectives: evaluate the guard on each interpretation
+        return np.array(
+            [
+                guard.subs({symbol: True}).replace(Symbol, BooleanFalse) == True  # noqa: E712
+                for symbol in self.alphabet
+            ],
+            dtype=bool,
+        )
+
+    def successors(self, sym_automaton: SymbolicDFA, state: Any) -> List[Any]:
+        """
+        Get the successors of a state for each symbol.
+
+        :param sym_automaton: the symbolic DFA
+        :param state: the state
+        :return: the successor for each symbol, or None if there is no transition
+        """
+        result: List[Any] = [None] * len(self.alphabet)
+        for _, guard, next_state in sym_automaton.get_transitions_from(state):
+            for index in np.flatnonzero(self.mask(guard)).tolist():
+                result[index] = next_state
+        return result
+
+
 def from_symbolic_automaton_to_declare_automaton(
     sym_automaton: SymbolicDFA, all_symbols: Set[str]
 ) -> SimpleDFA:
@@ -21,14 +97,19 @@ def from_symbolic_automaton_to_declare_automaton(
     accepting_states = sym_automaton.accepting_states
     transition_function = {}
 
+    # the guards are compiled once, instead of evaluating them with sympy for every symbol
+    alphabet = list(all_symbols)
+    guards = _OneHotGuards(alphabet)
     queue: Deque = deque()
     discovered = set()
     queue.append(initial_state)
     while len(queue) != 0:
         current_state = queue.popleft()
         discovered.add(current_state)
-        for symbol in all_symbols:
-            next_state = sym_automaton.get_successor(current_state, {symbol: True})
+        next_states = guards.successors(sym_automaton, current_state)
+        for symbol, next_state in zip(alphabet, next_states):
+            if next_state is None:
+                continue
             transition_function.setdefault(current_state, {})[symbol] = next_state
             if next_state not in discovered:
                 queue.append(next_state)
@@ -83,3 +164,233 @@ def _find_failure_state(dfa: DFA):
                 # non-accepting, self-loop with true
                 return start
     return None
+
+
+# an explicit DFA over the symbols of a fixed alphabet, with initial state 0:
+# the transition table (|states| x |alphabet|) and the accepting mask
+ExplicitDFA = Tuple[np.ndarray, np.ndarray]
+
+_MISSING_TRANSITION = -1
+
+DeclareConstraint = Tuple[Union[str, Callable[..., str]], ...]
+
+
+def _constraint_args(constraint: DeclareConstraint) -> Tuple[str, ...]:
+    """Get the symbols of a Declare constraint (all its items but the template)."""
+    return cast(Tuple[str, ...], constraint[1:])
+
+
+@lru_cache(maxsize=None)
+def _template_dfa(template: str, args: Tuple[str, ...], alphabet: Tuple[str, ...]) -> ExplicitDFA:
+    """Instantiate the DFA of a Declare template over an alphabet."""
+    assert template in TEMPLATE_DFAS, f"no DFA for template {template}"
+    accepting, transitions = TEMPLATE_DFAS[template]
+    assert len(transitions[0]) == len(args) + 1, f"wrong number of arguments for {template}"
+    other_letter = len(args)
+    letters = [args.index(symbol) if symbol in args else other_letter for symbol in alphabet]
+    table = np.array(transitions, dtype=np.int64)[:, letters]
+    table.setflags(write=False)
+    accepting_mask = np.array(accepting, dtype=bool)
+    accepting_mask.setflags(write=False)
+    return table, accepting_mask
+
+
+def _product(first: ExplicitDFA, second: ExplicitDFA) -> ExplicitDFA:
+    """Compute the reachable part of the product of two DFAs over the same alphabet."""
+    first_table, first_accepting = first
+    second_table, second_accepting = second
+    nb_second_states = len(second_accepting)
+    # the pair (i, j) is encoded as i * |second states| + j; visited is sorted
+    visited = np.zeros(1, dtype=np.int64)
+    frontier = visited
+    while frontier.size > 0:
+        i, j = np.divmod(frontier, nb_second_states)
+        successors = first_table[i] * nb_second_states + second_table[j]
+        frontier = np.setdiff1d(successors, visited)
+        visited = np.union1d(visited, frontier)
+    i, j = np.divmod(visited, nb_second_states)
+    table = np.searchsorted(visited, first_table[i] * nb_second_states + second_table[j])
+    return table, first_accepting[i] & second_accepting[j]
+
+
+def minimize_explicit_dfa(dfa: ExplicitDFA) -> ExplicitDFA:
+    """
+    Minimize a complete DFA whose states are all reachable (Moore's algorithm).
+
+    :param dfa: the transition table and the accepting mask
+    :return: the minimal DFA; the class of the initial state is the new state 0
+    """
+    table, accepting = dfa
+    classes = accepting.astype(np.int64)
+    nb_classes = len(np.unique(classes))
+    while True:
+        signatures = np.column_stack([classes, classes[table]])
+        _, new_classes = np.unique(signatures, axis=0, return_inverse=True)
+        new_classes = new_classes.ravel()
+        nb_new_classes = int(new_classes.max()) + 1
+        classes = new_classes
+        if nb_new_classes == nb_classes:
+            break
+        nb_classes = nb_new_classes
+    # number the classes by their first state, so that the initial state stays 0
+    _, representatives = np.unique(classes, return_index=True)
+    order = np.argsort(representatives)
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+    representatives = representatives[order]
+    return ranks[classes[table[representatives]]], accepting[representatives]
+
+
+def explicit_dfa_to_simple_dfa(dfa: ExplicitDFA, alphabet: Sequence[str]) -> SimpleDFA:
+    """
+    Convert an explicit DFA to a SimpleDFA with states 0, 1, ...
+
+    :param dfa: the transition table and the accepting mask
+    :param alphabet: the symbols, in the order of the columns of the table
+    :return: the SimpleDFA
+    """
+    table, accepting = dfa
+    transition_function = {
+        state: dict(zip(alphabet, next_states))
+        for state, next_states in enumerate(table.tolist())
+    }
+    return SimpleDFA(
+        set(range(len(accepting))),
+        set(alphabet),
+        0,
+        set(np.flatnonzero(accepting).tolist()),
+        transition_function,
+    )
+
+
+def _order_constraints(constraints: Sequence[DeclareConstraint]) -> Sequence[DeclareConstraint]:
+    """
+    Order the constraints so that each one adds as few new symbols as possible.
+
+    Constraints over disjoint symbols interleave freely, so their product is
+    exponential; intersecting first the constraints that are connected by
+    shared symbols keeps the intermediate DFAs small.
+    """
+    remaining = list(constraints)
+    result = []
+    seen_symbols: Set[str] = set()
+    while len(remaining) > 0:
+        best_index = min(
+            range(len(remaining)),
+            key=lambda index: (
+                len(set(_constraint_args(remaining[index])) - seen_symbols),
+                -len(set(_constraint_args(remaining[index])) & seen_symbols),
+                index,
+            ),
+        )
+        constraint = remaining.pop(best_index)
+        result.append(constraint)
+        seen_symbols.update(_constraint_args(constraint))
+    return result
+
+
+def declare_constraints_to_dfa(
+    constraints: Sequence[DeclareConstraint], all_symbols: Set[str]
+) -> SimpleDFA:
+    """
+    Compile a conjunction of Declare constraints to a minimal DFA, compositionally.
+
+    Each constraint is a tuple (template, *args), where the template is one of
+    the functions in declare_utils (or its name), e.g. (exactly_once, "a").
+    The DFA of each constraint is instantiated from the explicit template DFAs
+    over the simple alphabet (exactly one symbol per step, hence without the
+    need for build_declare_assumption), and the constraints are intersected
+    one at a time (starting from the ones connected by shared symbols),
+    minimizing after each product.
+
+    :param constraints: the Declare constraints
+    :param all_symbols: the symbols of the alphabet
+    :return: the minimal complete DFA, with states 0, 1, ... and initial state 0
+    """
+    alphabet = tuple(sorted(all_symbols))
+    result: ExplicitDFA = (
+        np.zeros((1, len(alphabet)), dtype=np.int64),
+        np.ones(1, dtype=bool),
+    )
+    for constraint in _order_constraints(constraints):
+        template = constraint[0]
+        template_name = template if isinstance(template, str) else template.__name__
+        constraint_dfa = _template_dfa(template_name, _constraint_args(constraint), alphabet)
+        result = minimize_explicit_dfa(_product(result, constraint_dfa))
+    return explicit_dfa_to_simple_dfa(result, alphabet)
+
+
+def symbolic_dfa_to_explicit_dfa(
+    sym_automaton: SymbolicDFA, alphabet: Sequence[str]
+) -> ExplicitDFA:
+    """
+    Project a symbolic DFA on the simple alphabet.
+
+    The simple alphabet is the set of interpretations where exactly one symbol is true.
+    Only the states reachable with such interpretations are kept, and missing
+    transitions go to a rejecting sink state.
+
+    :param sym_automaton: the symbolic DFA
+    :param alphabet: the symbols, in the order of the columns of the table
+    :return: the explicit DFA (initial state 0)
+    """
+    guards = _OneHotGuards(alphabet)
+    state_ids = {sym_automaton.initial_state: 0}
+    states = [sym_automaton.initial_state]
+    rows = []
+    for state in states:
+        row = []
+        for next_state in guards.successors(sym_automaton, state):
+            if next_state is None:
+                row.append(_MISSING_TRANSITION)
+                continue
+            if next_state not in state_ids:
+                state_ids[next_state] = len(states)
+                states.append(next_state)
+            row.append(state_ids[next_state])
+        rows.append(row)
+    table = np.array(rows, dtype=np.int64).reshape(len(rows), len(alphabet))
+    accepting = np.array([state in sym_automaton.accepting_states for state in states])
+    if np.any(table == _MISSING_TRANSITION):
+        sink_id = len(states)
+        table[table == _MISSING_TRANSITION] = sink_id
+        table = np.vstack([table, np.full((1, len(alphabet)), sink_id, dtype=np.int64)])
+        accepting = np.append(accepting, False)
+    return table, accepting
+
+
+def from_symbolic_automaton_to_simple_alphabet_dfa(
+    sym_automaton: SymbolicDFA, all_symbols: Set[str]
+) -> SimpleDFA:
+    """
+    Convert a symbolic DFA to a minimal DFA over the simple alphabet.
+
+    Since only one-hot interpretations are explored, the symbolic DFA does not
+    need the 'exactly one symbol per step' assumption (build_declare_assumption):
+    the formula is compiled as is, and the states that the assumption would have
+    merged are merged by the minimization.
+
+    :param sym_automaton: the symbolic DFA
+    :param all_symbols: the symbols of the alphabet
+    :return: the minimal complete DFA, with states 0, 1, ... and initial state 0
+    """
+    alphabet = tuple(sorted(all_symbols))
+    explicit_dfa = symbolic_dfa_to_explicit_dfa(sym_automaton, alphabet)
+    return explicit_dfa_to_simple_dfa(minimize_explicit_dfa(explicit_dfa), alphabet)
+
+
+def ltlf_to_simple_alphabet_dfa(formula_str: str, all_symbols: Set[str]) -> SimpleDFA:
+    """
+    Compile an LTLf formula to a minimal DFA over the simple alphabet, with Lydia.
+
+    The formula must not include the 'exactly one symbol per step' assumption:
+    it is enforced by the construction, so the formula stays linear in the
+    number of constraints.
+
+    :param formula_str: the LTLf formula, in Lydia syntax
+    :param all_symbols: the symbols of the alphabet
+    :return: the minimal complete DFA, with states 0, 1, ... and initial state 0
+    """
+    formula = parse_ltl(formula_str)
+    automaton = ltl2dfa(formula, backend="lydia")
+    return from_symbolic_automaton_to_simple_alphabet_dfa(automaton, all_symbols)
@@ -0,0 +1,91 @@
+"""This module implements immutable, hash-consed probability distributions."""
+import weakref
+from typing import Any, FrozenSet, Hashable, Iterable, Iterator, Mapping, Tuple, Union
+
+from stochastic_service_composition.types import Prob
+
+
+class Distribution(Mapping):
+    """
+    An immutable probability distribution over a few outcomes.
+
+    Distributions are hash-consed: building a distribution with the same
+    outcomes and probabilities of a live one, in any order, gives back that
+    same object. Hence, the many occurrences of the same distribution
+    (e.g. {"do": 0.95, "br": 0.05} in every breakable service) share a single
+    object, and equality checks between them are identity checks.
+
+    The outcomes are kept in a tuple, in insertion order; lookups are linear
+    scans, which is faster than hashing for the handful of outcomes of a
+    service transition.
+    """
+
+    __slots__ = ("_outcomes", "_probs", "_hash", "__weakref__")
+
+    _outcomes: Tuple[Hashable, ...]
+    _probs: Tuple[Prob, ...]
+    _hash: int
+
+    _interned: "weakref.WeakValueDictionary[FrozenSet[Tuple[Hashable, Prob]], Distribution]" = (
+        weakref.WeakValueDictionary()
+    )
+
+    def __new__(
+        cls, outcomes: Union[Mapping[Any, Prob], Iterable[Tuple[Hashable, Prob]]]
+    ) -> "Distribution":
+        """
+        Get the distribution with the given outcomes.
+
+        :param outcomes: the mapping from outcomes to probabilities, or the (outcome, probability) pairs
+        :return: the interned distribution
+        """
+        if isinstance(outcomes, Distribution):
+            return outcomes
+        items = tuple(outcomes.items() if isinstance(outcomes, Mapping) else outcomes)
+        # the key does not depend on the order, as the equality of mappings
+        key = frozenset(items)
+        result = cls._interned.get(key)
+        if result is None:
+            result = super().__new__(cls)
+            result._outcomes = tuple(outcome for outcome, _ in items)
+            result._probs = tuple(prob for _, prob in items)
+            result._hash = hash(key)
+            cls._interned[key] = result
+        return result
+
+    def __getitem__(self, outcome: Hashable) -> Prob:
+        """Get the probability of an outcome."""
+        for other, prob in zip(self._outcomes, self._probs):
+            if other == outcome:
+                return prob
+        raise KeyError(outcome)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        """Iterate over the outcomes."""
+        return iter(self._outcomes)
+
+    def __len__(self) -> int:
+        """Get the number of outcomes."""
+        return len(self._outcomes)
+
+    def items(self) -> Iterator[Tuple[Hashable, Prob]]:  # type: ignore
+        """Iterate over the (outcome, probability) pairs, without lookups."""
+        return zip(self._outcomes, self._probs)
+
+    def __hash__(self) -> int:
+        """Get the hash of the distribution."""
+        return self._hash
+
+    def __eq__(self, other: object) -> bool:
+        """Compare with another mapping."""
+        if self is other:
+            return True
+        return super().__eq__(other)
+
+    def __reduce__(self):
+        """Pickle by value; unpickling interns the distribution again."""
+        return Distribution, (tuple(self.items()),)
+
+    def __repr__(self) -> str:
+        """Get the string representation."""
+        return f"Distribution({dict(self.items())!r})"
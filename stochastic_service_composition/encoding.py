@@ -0,0 +1,116 @@
+"""This module implements the integer encoding of the joint states of a community."""
+from typing import Dict, Sequence, Tuple
+
+from stochastic_service_composition.types import State
+
+
+class StateEncoder:
+    """
+    Encode the joint states of a community of services as integers.
+
+    Each local state of the i-th component is mapped to a small integer in
+    [0, radix_i), and a joint state is packed in a single integer using a
+    mixed-radix representation:
+
+        code = sum_i index_i * stride_i,   stride_0 = 1, stride_i = stride_{i-1} * radix_{i-1}
+
+    Hence, the i-th component of a code can be read or replaced in constant time.
+    """
+
+    def __init__(self, local_states: Sequence[Sequence[State]]):
+        """
+        Initialize the encoder.
+
+        :param local_states: for each component, the sequence of its local states
+        """
+        self.local_states: Tuple[Tuple[State, ...], ...] = tuple(
+            tuple(states) for states in local_states
+        )
+        assert all(
+            len(states) > 0 for states in self.local_states
+        ), "every component must have at least one state"
+        self.local_indexes: Tuple[Dict[State, int], ...] = tuple(
+            {state: index for index, state in enumerate(states)}
+            for states in self.local_states
+        )
+        self.radixes: Tuple[int, ...] = tuple(len(states) for states in self.local_states)
+        strides = []
+        size = 1
+        for radix in self.radixes:
+            strides.append(size)
+            size *= radix
+        self.strides: Tuple[int, ...] = tuple(strides)
+        self.size = size
+
+    @property
+    def nb_components(self) -> int:
+        """Get the number of components."""
+        return len(self.radixes)
+
+    def encode_local(self, component: int, local_state: State) -> int:
+        """Get the index of a local state of a component."""
+        return self.local_indexes[component][local_state]
+
+    def decode_local(self, component: int, local_index: int) -> State:
+        """Get the local state of a component from its index."""
+        return self.local_states[component][local_index]
+
+    def encode_indexes(self, local_indexes: Sequence[int]) -> int:
+        """Pack a sequence of local indexes in a single integer."""
+        return sum(index * stride for index, stride in zip(local_indexes, self.strides))
+
+    def encode(self, state: Sequence[State]) -> int:
+        """
+        Encode a joint state.
+
+        :param state: the tuple of local states
+        :return: the integer code
+        """
+        assert len(state) == self.nb_components, "wrong number of components"
+        return self.encode_indexes(
+            [
+                local_indexes[local_state]
+                for local_indexes, local_state in zip(self.local_indexes, state)
+            ]
+        )
+
+    def decode(self, code: int) -> Tuple[State, ...]:
+        """
+        Decode a joint state.
+
+        :param code: the integer code
+        :return: the tuple of local states
+        """
+        result = []
+        for local_states, radix in zip(self.local_states, self.radixes):
+            code, local_index = divmod(code, radix)
+            result.append(local_states[local_index])
+        return tuple(result)
+
+    def component(self, code: int, component: int) -> int:
+        """Get the local index of a component of a joint state."""
+        return (code // self.strides[component]) % self.radixes[component]
+
+    def replace(self, code: int, component: int, local_index: int) -> int:
+        """Replace the local index of a component of a joint state."""
+        return code + (local_index - self.component(code, component)) * self.strides[
+            component
+        ]
+
+    def is_valid(self, code: object) -> bool:
+        """Check that an object is a valid code."""
+        return isinstance(code, int) and 0 <= code < self.size
+
+    def decode_composition_state(self, state: State) -> State:
+        """
+        Decode a composition MDP state, for display purposes.
+
+        Composition states are tuples whose first element is the encoded system
+        state; other states (e.g. the initial or the sink state) are returned as is.
+
+        :param state: the composition state
+        :return: the composition state with the system state decoded
+        """
+        if isinstance(state, tuple) and len(state) > 0 and self.is_valid(state[0]):
+            return (self.decode(state[0]),) + state[1:]
+        return state
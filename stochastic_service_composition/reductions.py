@@ -0,0 +1,619 @@
+"""This module implements reductions of sparse composition MDPs."""
+from collections import deque
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+from pythomata import SimpleDFA
+
+from stochastic_service_composition.composition_mdp import (
+    COMPOSITION_MDP_SINK_STATE,
+    COMPOSITION_MDP_UNDEFINED_ACTION,
+)
+from stochastic_service_composition.solvers import SolverResult
+from stochastic_service_composition.sparse_mdp import (
+    SparseMDP,
+    SparseMDPBuilder,
+    concat_ranges,
+)
+from stochastic_service_composition.target import Target
+from stochastic_service_composition.types import State
+
+
+def backward_reachable(mdp: SparseMDP, goal_mask: np.ndarray) -> np.ndarray:
+    """
+    Compute the states from which a goal state is reachable (goal states included).
+
+    :param mdp: the sparse MDP
+    :param goal_mask: the goal states, as a boolean mask over state ids
+    :return: the boolean mask of the backward reachable states
+    """
+    row_states = mdp.row_states()
+    entry_states = row_states[mdp.entry_rows()]
+    # predecessors graph: next state -> state
+    predecessors = scipy.sparse.csr_matrix(
+        (np.ones(mdp.nb_transitions, dtype=bool), (mdp.next_states, entry_states)),
+        shape=(mdp.nb_states, mdp.nb_states),
+    )
+    reached = np.array(goal_mask, dtype=bool)
+    frontier = np.flatnonzero(reached)
+    while frontier.size > 0:
+        candidates = np.unique(predecessors[frontier].indices)
+        frontier = candidates[~reached[candidates]]
+        reached[frontier] = True
+    return reached
+
+
+def prune_to_sink(
+    mdp: SparseMDP, is_goal: Callable[[State], bool]
+) -> Tuple[SparseMDP, int, int]:
+    """
+    Collapse the states that cannot reach a goal state into a single sink state.
+
+    The sink state is COMPOSITION_MDP_SINK_STATE, with an 'undefined' self-loop
+    and reward 0; the transitions to the removed states are redirected to it.
+    The states that can reach a row with a non-zero reward are kept as well
+    (e.g. repairing broken services after the goal became unreachable): the
+    removed states can only collect rewards 0, so they have value 0 as the sink
+    and the optimal values of the kept states do not change.
+    The initial state is always kept.
+    An existing sink state is replaced by the new one, and it is not counted
+    among the collapsed states: if it is the only one, the MDP is returned as is.
+
+    :param mdp: the sparse MDP
+    :param is_goal: the predicate on state labels that identifies the goal states
+    :return: the pruned MDP, the number of states collapsed into the sink, and the number
+      of removed transitions
+    """
+    goal_mask = np.array([bool(is_goal(state)) for state in mdp.states], dtype=bool)
+    goal_mask[mdp.row_states()[mdp.rewards != 0.0]] = True
+    kept = backward_reachable(mdp, goal_mask)
+    if mdp.initial_state is not None:
+        kept[mdp.state_index[mdp.initial_state]] = True
+    collapsed = ~kept
+    old_sink_id = mdp.state_index.get(COMPOSITION_MDP_SINK_STATE)
+    if old_sink_id is not None:
+        collapsed[old_sink_id] = False
+    if not np.any(collapsed):
+        return mdp, 0, 0
+
+    kept_state_ids = np.flatnonzero(kept)
+    nb_kept_states = len(kept_state_ids)
+    sink_id = nb_kept_states
+    new_state_ids = np.full(mdp.nb_states, sink_id, dtype=np.int64)
+    new_state_ids[kept_state_ids] = np.arange(nb_kept_states, dtype=np.int64)
+
+    # rows and entries of the kept states; the next states are renumbered
+    row_states = mdp.row_states()
+    kept_rows = np.flatnonzero(kept[row_states])
+    entry_rows = mdp.entry_rows()
+    kept_entries = np.flatnonzero(kept[row_states[entry_rows]])
+    new_row_ids = np.cumsum(kept[row_states]) - 1
+    entry_new_rows = new_row_ids[entry_rows[kept_entries]]
+    entry_next_states = new_state_ids[mdp.next_states[kept_entries]]
+    # merge the entries of a row that are redirected to the sink
+    nb_new_states = nb_kept_states + 1
+    keys, inverse = np.unique(
+        entry_new_rows * nb_new_states + entry_next_states, return_inverse=True
+    )
+    probs = np.bincount(inverse.ravel(), weights=mdp.probs[kept_entries])
+    entry_new_rows, next_states = np.divmod(keys, nb_new_states)
+
+    actions = list(mdp.actions)
+    if COMPOSITION_MDP_UNDEFINED_ACTION not in actions:
+        actions.append(COMPOSITION_MDP_UNDEFINED_ACTION)
+    undefined_action_id = actions.index(COMPOSITION_MDP_UNDEFINED_ACTION)
+
+    nb_kept_rows = len(kept_rows)
+    row_lengths = np.bincount(entry_new_rows, minlength=nb_kept_rows)
+    row_ptr = np.zeros(nb_kept_rows + 2, dtype=np.int64)
+    np.cumsum(np.append(row_lengths, 1), out=row_ptr[1:])
+    nb_rows_by_state = np.diff(mdp.state_ptr)[kept_state_ids]
+    state_ptr = np.zeros(nb_new_states + 1, dtype=np.int64)
+    np.cumsum(np.append(nb_rows_by_state, 1), out=state_ptr[1:])
+
+    result = SparseMDP(
+        [mdp.states[i] for i in kept_state_ids.tolist()] + [COMPOSITION_MDP_SINK_STATE],
+        actions,
+        state_ptr,
+        np.append(mdp.row_actions[kept_rows], undefined_action_id).astype(
+            mdp.row_actions.dtype
+        ),
+        row_ptr,
+        np.append(next_states, sink_id).astype(mdp.next_states.dtype),
+        np.append(probs, 1.0),
+        np.append(mdp.rewards[kept_rows], 0.0),
+        mdp.gamma,
+        initial_state=mdp.initial_state,
+        state_encoder=mdp.state_encoder,
+        row_steps=None if mdp.row_steps is None else np.append(mdp.row_steps[kept_rows], 1),
+        symmetry_groups=mdp.symmetry_groups,
+    )
+    return result, int(np.count_nonzero(collapsed)), mdp.nb_transitions - result.nb_transitions
+
+
+def prune_comp_mdp(mdp: SparseMDP, dfa: SimpleDFA) -> Tuple[SparseMDP, int, int]:
+    """
+    Prune a composition MDP built by 'comp_mdp' (see 'prune_to_sink').
+
+    The goal states are the ones whose DFA state is accepting.
+    Since the states that can reach a non-zero reward are kept, only the
+    zero-reward dead ends are removed: on communities whose actions have costs
+    the pass is nearly a no-op.
+
+    :param mdp: the sparse composition MDP
+    :param dfa: the DFA of the target specification
+    :return: the pruned MDP, the number of removed states and the number of removed transitions
+    """
+    accepting_states = dfa.accepting_states
+    return prune_to_sink(
+        mdp, lambda state: isinstance(state, tuple) and state[1] in accepting_states
+    )
+
+
+def prune_composition_mdp(mdp: SparseMDP, target: Target) -> Tuple[SparseMDP, int, int]:
+    """
+    Prune a composition MDP built by 'composition_mdp' (see 'prune_to_sink').
+
+    The goal states are the ones whose target state, or the target state reached
+    with their symbol, is final: the final target states have no policy, hence
+    the composition states enter them only through the rows of their predecessors.
+    As in 'prune_comp_mdp', only the zero-reward dead ends are removed, hence
+    the pass is nearly a no-op when the actions of the services have costs.
+
+    :param mdp: the sparse composition MDP
+    :param target: the target service
+    :return: the pruned MDP, the number of removed states and the number of removed transitions
+    """
+    final_states = target.final_states
+    transition_function = target.transition_function
+
+    def is_goal(state: State) -> bool:
+        if not isinstance(state, tuple):
+            return False
+        _, target_state, symbol = state
+        return (
+            target_state in final_states
+            or transition_function.get(target_state, {}).get(symbol) in final_states
+        )
+
+    return prune_to_sink(mdp, is_goal)
+
+
+# probabilities and rewards are compared after rounding, to absorb floating point noise
+BISIMULATION_DECIMALS = 12
+
+
+class BisimulationQuotient:
+    """
+    The quotient of a sparse MDP by probabilistic bisimulation.
+
+    Two states are bisimilar if they have the same set of (reward, steps,
+    distribution over blocks) triples, one per row, regardless of the action
+    labels; bisimilar states have the same optimal value. The quotient has one state per block
+    (labelled by its first state), and one row per distinct (reward, steps,
+    block distribution) of the block.
+    """
+
+    def __init__(
+        self,
+        mdp: SparseMDP,
+        quotient: SparseMDP,
+        state_blocks: np.ndarray,
+        row_signatures: np.ndarray,
+        quotient_row_signatures: np.ndarray,
+    ):
+        """
+        Initialize the quotient.
+
+        :param mdp: the original MDP
+        :param quotient: the quotient MDP
+        :param state_blocks: the block (quotient state id) of each state
+        :param row_signatures: the signature id of each row of the original MDP
+        :param quotient_row_signatures: the signature id of each row of the quotient
+        """
+        self.mdp = mdp
+        self.quotient = quotient
+        self.state_blocks = state_blocks
+        self.row_signatures = row_signatures
+        self.quotient_row_signatures = quotient_row_signatures
+
+    def lift(self, result: SolverResult) -> SolverResult:
+        """
+        Lift the result of a solver on the quotient to the original MDP.
+
+        Each state gets the value of its block, and the first of its rows whose
+        (reward, steps, block distribution) is the one chosen in the block.
+
+        :param result: the result on the quotient MDP
+        :return: the result on the original MDP
+        """
+        mdp = self.mdp
+        row_states = mdp.row_states()
+        chosen_signatures = self.quotient_row_signatures[result.policy_rows]
+        is_chosen = self.row_signatures == chosen_signatures[self.state_blocks[row_states]]
+        candidates = np.where(is_chosen, np.arange(mdp.nb_rows, dtype=np.int64), mdp.nb_rows)
+        policy_rows = np.minimum.reduceat(candidates, mdp.state_ptr[:-1])
+        return SolverResult(
+            mdp,
+            result.values[self.state_blocks],
+            policy_rows,
+            result.iterations,
+            result.iteration_times,
+        )
+
+
+def _sequence_ids(
+    prefixes: np.ndarray, ptr: np.ndarray, values: np.ndarray
+) -> Tuple[np.ndarray, int]:
+    """
+    Give an id to each distinct (prefix, sequence) pair.
+
+    The sequence of item i is values[ptr[i]:ptr[i + 1]]; the items are grouped by
+    sequence length, and the ids of a group are refined one position at a time.
+
+    :param prefixes: the non-negative integer prefix of each item
+    :param ptr: the offsets of the sequences of the items in 'values'
+    :param values: the concatenated non-negative integer sequences
+    :return: the id of each item, and the number of ids
+    """
+    lengths = np.diff(ptr)
+    nb_values = int(values.max()) + 1 if len(values) > 0 else 1
+    ids = np.empty(len(lengths), dtype=np.int64)
+    nb_ids = 0
+    for length in np.flatnonzero(np.bincount(lengths)).tolist():
+        items = np.flatnonzero(lengths == length)
+        _, group_ids = np.unique(prefixes[items], return_inverse=True)
+        for position in ptr[items] + np.arange(length)[:, np.newaxis]:
+            _, group_ids = np.unique(
+                group_ids.ravel() * nb_values + values[position], return_inverse=True
+            )
+        group_ids = group_ids.ravel()
+        ids[items] = group_ids + nb_ids
+        nb_ids += int(group_ids.max()) + 1
+    return ids, nb_ids
+
+
+def _block_distributions(
+    mdp: SparseMDP, state_blocks: np.ndarray, nb_blocks: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute the distribution over blocks of each row.
+
+    :return: the offsets of the rows, and the blocks and the rounded probabilities of their entries
+    """
+    keys, inverse = np.unique(
+        mdp.entry_rows() * nb_blocks + state_blocks[mdp.next_states], return_inverse=True
+    )
+    block_probs = np.round(
+        np.bincount(inverse.ravel(), weights=mdp.probs), BISIMULATION_DECIMALS
+    )
+    key_rows, key_blocks = np.divmod(keys, nb_blocks)
+    row_ptr = np.searchsorted(key_rows, np.arange(mdp.nb_rows + 1))
+    return row_ptr, key_blocks, block_probs
+
+
+def _row_prefixes(mdp: SparseMDP) -> np.ndarray:
+    """Give an id to each distinct (rounded reward, steps) pair of the rows."""
+    row_steps = np.ones(mdp.nb_rows, dtype=np.int64) if mdp.row_steps is None else mdp.row_steps
+    _, prefixes = np.unique(
+        np.column_stack([np.round(mdp.rewards, BISIMULATION_DECIMALS), row_steps]),
+        axis=0,
+        return_inverse=True,
+    )
+    return prefixes.ravel()
+
+
+def _row_signatures(
+    mdp: SparseMDP, row_prefixes: np.ndarray, state_blocks: np.ndarray, nb_blocks: int
+) -> Tuple[np.ndarray, int]:
+    """Compute the id of the (reward, steps, block distribution) of each row."""
+    row_ptr, blocks, block_probs = _block_distributions(mdp, state_blocks, nb_blocks)
+    prob_values, prob_ids = np.unique(block_probs, return_inverse=True)
+    entry_ids = blocks * len(prob_values) + prob_ids.ravel()
+    return _sequence_ids(row_prefixes, row_ptr, entry_ids)
+
+
+def _refine_blocks(
+    mdp: SparseMDP, state_blocks: np.ndarray, row_signatures: np.ndarray, nb_signatures: int
+) -> Tuple[np.ndarray, int]:
+    """Split the blocks according to the set of signatures of the rows of their states."""
+    pairs = np.sort(mdp.row_states() * nb_signatures + row_signatures)
+    pairs = pairs[np.append(True, pairs[1:] != pairs[:-1])]
+    pair_states, pair_signatures = np.divmod(pairs, nb_signatures)
+    state_ptr = np.searchsorted(pair_states, np.arange(mdp.nb_states + 1))
+    return _sequence_ids(state_blocks, state_ptr, pair_signatures)
+
+
+def bisimulation_quotient(mdp: SparseMDP) -> BisimulationQuotient:
+    """
+    Compute the quotient of a sparse MDP by probabilistic bisimulation.
+
+    The partition is refined until it is stable: at each round, the states of
+    a block are split according to the set of signatures of their rows, where
+    the signature of a row is its reward, its steps and its distribution over
+    the blocks.
+
+    :param mdp: the sparse MDP
+    :return: the quotient, with the mapping to lift solutions back
+    """
+    row_prefixes = _row_prefixes(mdp)
+    state_blocks = np.zeros(mdp.nb_states, dtype=np.int64)
+    nb_blocks = 1
+    while True:
+        row_signatures, nb_signatures = _row_signatures(
+            mdp, row_prefixes, state_blocks, nb_blocks
+        )
+        new_state_blocks, nb_new_blocks = _refine_blocks(
+            mdp, state_blocks, row_signatures, nb_signatures
+        )
+        if nb_new_blocks == nb_blocks:
+            break
+        state_blocks, nb_blocks = new_state_blocks, nb_new_blocks
+
+    # the partition is stable: the signatures of the last round are the final ones
+    row_ptr, blocks, block_probs = _block_distributions(mdp, state_blocks, nb_blocks)
+    _, representatives = np.unique(state_blocks, return_index=True)
+    representatives = representatives.tolist()
+    signature_list = row_signatures.tolist()
+    state_starts = mdp.state_ptr.tolist()
+    row_starts = row_ptr.tolist()
+    blocks, block_probs = blocks.tolist(), block_probs.tolist()
+    rewards = np.round(mdp.rewards, BISIMULATION_DECIMALS).tolist()
+    row_steps = [1] * mdp.nb_rows if mdp.row_steps is None else mdp.row_steps.tolist()
+
+    builder = SparseMDPBuilder()
+    for state in representatives:
+        builder.add_state(mdp.states[state])
+    quotient_row_signatures = []
+    for block, state in enumerate(representatives):
+        seen_signatures = set()
+        for row in range(state_starts[state], state_starts[state + 1]):
+            signature_id = signature_list[row]
+            if signature_id in seen_signatures:
+                continue
+            seen_signatures.add(signature_id)
+            start, end = row_starts[row], row_starts[row + 1]
+            builder.add_row(
+                block,
+                mdp.actions[mdp.row_actions[row]],
+                dict(zip(blocks[start:end], block_probs[start:end])),
+                rewards[row],
+                row_steps[row],
+            )
+            quotient_row_signatures.append(signature_id)
+
+    initial_state = None
+    if mdp.initial_state is not None:
+        initial_block = state_blocks[mdp.state_index[mdp.initial_state]]
+        initial_state = mdp.states[representatives[initial_block]]
+    quotient = builder.build(
+        mdp.gamma,
+        initial_state=initial_state,
+        state_encoder=mdp.state_encoder,
+        symmetry_groups=mdp.symmetry_groups,
+    )
+    return BisimulationQuotient(
+        mdp,
+        quotient,
+        state_blocks,
+        row_signatures,
+        np.array(quotient_row_signatures, dtype=np.int64),
+    )
+
+
+class MacroCompression:
+    """
+    The compression of the deterministic chains of a sparse MDP into macro-transitions.
+
+    A state is forced if it has a single row (e.g. a composition state where the
+    only possible move is a housekeeping action, such as the configuration or the
+    repair of a service). A row that leads deterministically to a forced state is
+    replaced by the macro-transition that also takes the row of the forced state,
+    and so on along the chain; the forced states that are only crossed by chains
+    are removed. A macro-transition of k steps has the discounted reward of the
+    chain, and its next states are discounted by gamma ** k.
+
+    The rewards of the macro-transitions depend on the discount factor, so the
+    compressed MDP must be solved with the discount factor of the original one.
+    """
+
+    def __init__(
+        self,
+        mdp: SparseMDP,
+        compressed: SparseMDP,
+        kept_states: np.ndarray,
+        original_rows: np.ndarray,
+    ):
+        """
+        Initialize the compression.
+
+        :param mdp: the original MDP
+        :param compressed: the compressed MDP
+        :param kept_states: the ids (in the original MDP) of the states of the compressed MDP
+        :param original_rows: the row of the original MDP of each row of the compressed MDP
+        """
+        self.mdp = mdp
+        self.compressed = compressed
+        self.kept_states = kept_states
+        self.original_rows = original_rows
+
+    def lift(self, result: SolverResult) -> SolverResult:
+        """
+        Lift the result of a solver on the compressed MDP to the original MDP.
+
+        The kept states get their value and row; the removed states, which have a
+        single row, get the values of the linear system of their rows.
+
+        :param result: the result on the compressed MDP
+        :return: the result on the original MDP
+        """
+        mdp = self.mdp
+        values = np.zeros(mdp.nb_states, dtype=np.float64)
+        values[self.kept_states] = result.values
+        policy_rows = mdp.state_ptr[:-1].copy()
+        policy_rows[self.kept_states] = self.original_rows[result.policy_rows]
+
+        is_removed = np.ones(mdp.nb_states, dtype=bool)
+        is_removed[self.kept_states] = False
+        removed_states = np.flatnonzero(is_removed)
+        if len(removed_states) > 0:
+            # (I - gamma P_RR) v_R = r_R + gamma P_RK v_K, over the single rows of the removed states
+            rows = mdp.state_ptr[removed_states]
+            nb_entries_by_row = mdp.row_ptr[rows + 1] - mdp.row_ptr[rows]
+            entries = concat_ranges(mdp.row_ptr[rows], nb_entries_by_row)
+            discounts = np.broadcast_to(mdp.discounts(), (mdp.nb_rows,))[rows]
+            entry_probs = np.repeat(discounts, nb_entries_by_row) * mdp.probs[entries]
+            entry_next_states = mdp.next_states[entries]
+            entry_removed_rows = np.repeat(
+                np.arange(len(removed_states), dtype=np.int64), nb_entries_by_row
+            )
+            constants = mdp.rewards[rows] + np.bincount(
+                entry_removed_rows,
+                weights=entry_probs * values[entry_next_states],
+                minlength=len(removed_states),
+            )
+            removed_ids = np.cumsum(is_removed) - 1
+            to_removed = is_removed[entry_next_states]
+            transitions = scipy.sparse.csr_matrix(
+                (
+                    entry_probs[to_removed],
+                    (entry_removed_rows[to_removed], removed_ids[entry_next_states[to_removed]]),
+                ),
+                shape=(len(removed_states), len(removed_states)),
+            )
+            system = scipy.sparse.identity(len(removed_states), format="csr") - transitions
+            values[removed_states] = scipy.sparse.linalg.spsolve(system.tocsc(), constants)
+        return SolverResult(
+            mdp, values, policy_rows, result.iterations, result.iteration_times
+        )
+
+
+class _ChainFinder:
+    """The detection of the deterministic chains through forced states of a sparse MDP."""
+
+    def __init__(self, mdp: SparseMDP):
+        """
+        Initialize the detection.
+
+        :param mdp: the sparse MDP
+        """
+        self.gamma = mdp.gamma
+        self.state_ptr = mdp.state_ptr.tolist()
+        self.row_ptr = mdp.row_ptr.tolist()
+        self.next_states = mdp.next_states.tolist()
+        self.rewards = mdp.rewards.tolist()
+        self.row_steps = [1] * mdp.nb_rows if mdp.row_steps is None else mdp.row_steps.tolist()
+        self.is_forced = (np.diff(mdp.state_ptr) == 1).tolist()
+        if mdp.initial_state is not None:
+            self.is_forced[mdp.state_index[mdp.initial_state]] = False
+
+    def follow(self, state: int, row: int) -> Tuple[float, int, int]:
+        """
+        Follow the chain of a row.
+
+        :param state: the state of the row
+        :param row: the row
+        :return: the discounted reward of the chain, its number of steps and its last row
+        """
+        row_ptr = self.row_ptr
+        reward = self.rewards[row]
+        steps = self.row_steps[row]
+        visited = {state}
+        while row_ptr[row + 1] - row_ptr[row] == 1:
+            next_state = self.next_states[row_ptr[row]]
+            if not self.is_forced[next_state] or next_state in visited:
+                break
+            visited.add(next_state)
+            row = self.state_ptr[next_state]
+            reward += self.gamma ** steps * self.rewards[row]
+            steps += self.row_steps[row]
+        return reward, steps, row
+
+    def macro_rows(self) -> Tuple[List[bool], Dict[int, Tuple[float, int, int]]]:
+        """
+        Find the kept states, and the macro-row of each of their rows.
+
+        The kept states are the non-forced ones, and the forced ones at the end of a chain.
+
+        :return: whether each state is kept, and the map row -> (reward, steps, last row)
+          for the rows of the kept states
+        """
+        state_ptr = self.state_ptr
+        row_ptr = self.row_ptr
+        is_kept = [not forced for forced in self.is_forced]
+        queue = deque(state for state, kept in enumerate(is_kept) if kept)
+        macro_rows: Dict[int, Tuple[float, int, int]] = {}
+        while len(queue) > 0:
+            state = queue.popleft()
+            for row in range(state_ptr[state], state_ptr[state + 1]):
+                macro_row = self.follow(state, row)
+                macro_rows[row] = macro_row
+                last_row = macro_row[2]
+                for next_state in self.next_states[row_ptr[last_row]:row_ptr[last_row + 1]]:
+                    if not is_kept[next_state]:
+                        is_kept[next_state] = True
+                        queue.append(next_state)
+        return is_kept, macro_rows
+
+
+def compress_chains(mdp: SparseMDP) -> MacroCompression:
+    """
+    Compress the deterministic chains through forced states into macro-transitions.
+
+    See MacroCompression. The initial state is never removed; the chains stop
+    before revisiting a state, so the cycles of forced states are kept.
+
+    :param mdp: the sparse MDP
+    :return: the compression, with the compressed MDP and the mapping to lift solutions back
+    """
+    is_kept, macro_rows = _ChainFinder(mdp).macro_rows()
+    return _build_compression(mdp, is_kept, macro_rows)
+
+
+def _build_compression(
+    mdp: SparseMDP, is_kept: List[bool], macro_rows: Dict[int, Tuple[float, int, int]]
+) -> MacroCompression:
+    """
+    Build the compressed MDP from the macro-rows of the kept states.
+
+    :param mdp: the sparse MDP
+    :param is_kept: whether each state is kept
+    :param macro_rows: the map row -> (reward, steps, last row) for the rows of the kept states
+    :return: the compression
+    """
+    state_ptr = mdp.state_ptr.tolist()
+    row_ptr = mdp.row_ptr.tolist()
+    next_states = mdp.next_states.tolist()
+    probs = mdp.probs.tolist()
+    kept_states = np.flatnonzero(is_kept)
+    builder = SparseMDPBuilder()
+    for state in kept_states.tolist():
+        builder.add_state(mdp.states[state])
+    new_state_ids = np.cumsum(is_kept) - 1
+    original_rows = []
+    for new_state_id, state in enumerate(kept_states.tolist()):
+        for row in range(state_ptr[state], state_ptr[state + 1]):
+            reward, steps, last_row = macro_rows[row]
+            start, end = row_ptr[last_row], row_ptr[last_row + 1]
+            builder.add_row(
+                new_state_id,
+                mdp.actions[mdp.row_actions[row]],
+                {
+                    int(new_state_ids[next_state]): prob
+                    for next_state, prob in zip(next_states[start:end], probs[start:end])
+                },
+                reward,
+                steps,
+            )
+            original_rows.append(row)
+    compressed = builder.build(
+        mdp.gamma,
+        initial_state=mdp.initial_state,
+        state_encoder=mdp.state_encoder,
+        symmetry_groups=mdp.symmetry_groups,
+    )
+    return MacroCompression(
+        mdp, compressed, kept_states, np.array(original_rows, dtype=np.int64)
+    )
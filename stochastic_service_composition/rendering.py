@@ -1,15 +1,28 @@
 """This module contains rendering functionalities."""
-from typing import Callable, Dict
+from typing import Callable, Dict, cast
 
 from graphviz import Digraph
 from mdp_dp_rl.processes.mdp import MDP
 
 from stochastic_service_composition.composition_mdp import COMPOSITION_MDP_INITIAL_STATE
-from stochastic_service_composition.services import Service
+from stochastic_service_composition.services import Service, SystemService
 from stochastic_service_composition.target import Target
 from stochastic_service_composition.types import Action, State
 
 
+def _decoding_state2str(
+    obj: object, state2str: Callable[[State], str]
+) -> Callable[[State], str]:
+    """Wrap state2str so that integer-encoded system states are displayed as tuples."""
+    if isinstance(obj, SystemService):
+        system_service = obj
+        return lambda state: state2str(system_service.decode(cast(int, state)))
+    encoder = getattr(obj, "state_encoder", None)
+    if encoder is not None:
+        return lambda state: state2str(encoder.decode_composition_state(state))
+    return state2str
+
+
 def service_to_graphviz(
     service: Service,
     state2str: Callable[[State], str] = lambda x: str(x),
@@ -23,6 +36,7 @@ def service_to_graphviz(
     :param action2str: a callable that transforms actions into strings
     :return: the graphviz.Digraph object
     """
+    state2str = _decoding_state2str(service, state2str)
     graph = Digraph(format="svg")
     graph.node("fake", style="invisible")
     graph.attr(rankdir="LR")
@@ -102,6 +116,7 @@ def mdp_to_graphviz(
     :param no_sink: don't print terminal states.
     :return: the graphviz.Digraph object
     """
+    state2str = _decoding_state2str(mdp, state2str)
     graph = Digraph(format="svg")
     graph.node("fake", style="invisible")
     graph.attr(rankdir="LR")
@@ -148,6 +163,7 @@ def mdp_to_graphviz2(
     :param action2str: a callable that transforms actions into strings
     :return: the graphviz.Digraph object
     """
+    state2str = _decoding_state2str(mdp, state2str)
     graph = Digraph(format="svg")
     graph.node("fake", style="invisible")
     graph.attr(rankdir="LR")
@@ -1,19 +1,41 @@
 """This module contains the implementation of the service abstraction."""
 
-from collections import deque
-from typing import Deque, Set, Tuple
+import itertools
+from array import array
+from collections import OrderedDict, deque
+from typing import (
+    AbstractSet,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
 
+from stochastic_service_composition.distributions import Distribution
+from stochastic_service_composition.encoding import StateEncoder
 from stochastic_service_composition.types import (
     Action,
+    MDPDynamics,
+    Prob,
+    Reward,
     State,
     TransitionFunction,
-    MDPDynamics,
 )
 
 
 class Service:
     """A service."""
 
+    __slots__ = ("states", "actions", "final_states", "initial_state", "transition_function")
+
     def __init__(
         self,
         states: Set[State],
@@ -96,6 +118,245 @@ class Service:
                 ), f"action {action} is not in the set of actions"
 
 
+class _LabelSet(AbstractSet):
+    """A read-only set view over a table of labels (e.g. the states of a compact service)."""
+
+    __slots__ = ("_labels", "_ids")
+
+    def __init__(self, labels: Sequence[Hashable], ids: Mapping[Hashable, int]):
+        """
+        Initialize the view.
+
+        :param labels: the labels, indexed by id
+        :param ids: the index from labels to ids
+        """
+        self._labels = labels
+        self._ids = ids
+
+    def __contains__(self, label: object) -> bool:
+        """Check whether the label is in the table."""
+        try:
+            return label in self._ids
+        except TypeError:
+            # unhashable
+            return False
+
+    def __iter__(self) -> Iterator[Hashable]:
+        """Iterate over the labels, in id order."""
+        return iter(self._labels)
+
+    def __len__(self) -> int:
+        """Get the number of labels."""
+        return len(self._labels)
+
+
+class _StateRows(Mapping):
+    """A read-only view over the rows of a state: action -> value of the row."""
+
+    __slots__ = ("_table", "_rows")
+
+    def __init__(self, table: "_RowTable", rows: Dict[Action, int]):
+        """
+        Initialize the view.
+
+        :param table: the row table
+        :param rows: the row of each action of the state
+        """
+        self._table = table
+        self._rows = rows
+
+    def __getitem__(self, action: Action):
+        """Get the value of the row of an action."""
+        try:
+            row = self._rows[action]
+        except TypeError:
+            # unhashable
+            raise KeyError(action)
+        return self._table.value(row)
+
+    def __iter__(self) -> Iterator[Action]:
+        """Iterate over the actions of the state."""
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        """Get the number of actions of the state."""
+        return len(self._rows)
+
+
+class _RowTable(Mapping):
+    """
+    A read-only view over flat (state, action) rows: state -> action -> value of the row.
+
+    The rows are found through a small index per state, from the actions to the
+    rows; only the states with at least one row are keys, as in the nested dicts.
+    """
+
+    __slots__ = ("state_labels", "state_ids", "state_rows", "value")
+
+    def __init__(
+        self,
+        state_labels: Sequence[State],
+        state_ids: Mapping[State, int],
+        state_rows: Sequence[Dict[Action, int]],
+        value: Callable[[int], object],
+    ):
+        """
+        Initialize the view.
+
+        :param state_labels: the state labels, indexed by id
+        :param state_ids: the index from state labels to ids
+        :param state_rows: by state id, the row of each action (see '_index_rows')
+        :param value: the function that gives the value of a row
+        """
+        self.state_labels = state_labels
+        self.state_ids = state_ids
+        self.state_rows = state_rows
+        self.value = value
+
+    def __getitem__(self, state: State) -> _StateRows:
+        """Get the rows of a state."""
+        state_id = self.state_ids.get(state)
+        if state_id is None or len(self.state_rows[state_id]) == 0:
+            raise KeyError(state)
+        return _StateRows(self, self.state_rows[state_id])
+
+    def __contains__(self, state: object) -> bool:
+        """Check whether the state has rows."""
+        try:
+            state_id = self.state_ids.get(state)
+        except TypeError:
+            return False
+        return state_id is not None and len(self.state_rows[state_id]) > 0
+
+    def __iter__(self) -> Iterator[State]:
+        """Iterate over the states with rows, in id order."""
+        for state, rows in zip(self.state_labels, self.state_rows):
+            if len(rows) > 0:
+                yield state
+
+    def __len__(self) -> int:
+        """Get the number of states with rows."""
+        return sum(1 for rows in self.state_rows if len(rows) > 0)
+
+
+def _index_rows(
+    action_labels: Sequence[Action], state_ptr: Sequence[int], row_actions: Sequence[int]
+) -> List[Dict[Action, int]]:
+    """
+    Index the flat (state, action) rows by state and action.
+
+    :param action_labels: the action labels, indexed by id
+    :param state_ptr: the offsets of the rows of each state: the rows of the state
+      with id s are the ones in [state_ptr[s], state_ptr[s + 1])
+    :param row_actions: the action id of each row
+    :return: by state id, the row of each action
+    """
+    return [
+        {action_labels[row_actions[row]]: row for row in range(start, end)}
+        for start, end in zip(state_ptr, state_ptr[1:])
+    ]
+
+
+def _index_labels(
+    labels: Iterable[Hashable], extra_labels: Iterable[Hashable] = ()
+) -> Tuple[Tuple[Hashable, ...], Dict[Hashable, int]]:
+    """Get the table of the distinct labels, in order of first occurrence, and its index."""
+    ids: Dict[Hashable, int] = {}
+    for label in itertools.chain(labels, extra_labels):
+        ids.setdefault(label, len(ids))
+    return tuple(ids), ids
+
+
+class CompactService(Service):
+    """
+    A service with array-backed states, actions and transitions.
+
+    States and actions are stored once, in index tables; the transitions are
+    flat rows, one per (state, action) pair and grouped by state, with an action
+    id, an interned next-state Distribution and a reward. The attributes of
+    Service ('states', 'actions', 'transition_function') are read-only views
+    over the tables, built once, so the service can be used wherever a Service
+    is expected.
+    """
+
+    __slots__ = (
+        "_state_labels",
+        "_state_ids",
+        "_action_labels",
+        "_action_ids",
+        "_state_ptr",
+        "_row_actions",
+        "_row_distributions",
+        "_row_rewards",
+    )
+
+    def __init__(
+        self,
+        states: Set[State],
+        actions: Set[Action],
+        final_states: Set[State],
+        initial_state: State,
+        transition_function: MDPDynamics,
+    ):
+        """
+        Initialize the service.
+
+        The ids of states and actions follow their first occurrence in the
+        transition function, so the views iterate in the same order of the dicts.
+
+        :param states: the set of states
+        :param actions: the set of actions
+        :param final_states: the final states
+        :param initial_state: the initial state
+        :param transition_function: the transition function
+        """
+        self._state_labels, self._state_ids = _index_labels(
+            itertools.chain(
+                transition_function,
+                (
+                    next_state
+                    for transitions_by_action in transition_function.values()
+                    for next_states, _reward in transitions_by_action.values()
+                    for next_state in next_states
+                ),
+            ),
+            sorted(states, key=repr),
+        )
+        self._action_labels, self._action_ids = _index_labels(
+            (
+                action
+                for transitions_by_action in transition_function.values()
+                for action in transitions_by_action
+            ),
+            sorted(actions, key=repr),
+        )
+        self._state_ptr = array("q", [0])
+        self._row_actions = array("q")
+        self._row_distributions: List[Distribution] = []
+        self._row_rewards = array("d")
+        for state in self._state_labels:
+            for action, (next_states, reward) in transition_function.get(state, {}).items():
+                self._row_actions.append(self._action_ids[action])
+                self._row_distributions.append(Distribution(next_states))
+                self._row_rewards.append(reward)
+            self._state_ptr.append(len(self._row_actions))
+        self.final_states = frozenset(final_states)  # type: ignore
+        self.initial_state = initial_state
+        self.states = _LabelSet(self._state_labels, self._state_ids)  # type: ignore
+        self.actions = _LabelSet(self._action_labels, self._action_ids)  # type: ignore
+        # state -> action -> (next-state distribution, reward)
+        self.transition_function = _RowTable(  # type: ignore
+            self._state_labels,
+            self._state_ids,
+            _index_rows(self._action_labels, self._state_ptr, self._row_actions),
+            self._transition,
+        )
+
+    def _transition(self, row: int) -> Tuple[Distribution, Reward]:
+        """Get the next-state distribution and the reward of a row."""
+        return self._row_distributions[row], self._row_rewards[row]
+
+
 def build_deterministic_service_from_transitions(
     transition_function: TransitionFunction,
     initial_state: State,
@@ -129,7 +390,7 @@ def build_deterministic_service_from_transitions(
     ), f"the following final states are not in the transition function: {unreachable_final_states}"
     assert initial_state in states, "initial state not in the set of states"
 
-    return Service(
+    return CompactService(
         states, actions, final_states, initial_state, new_transition_function
     )
 
@@ -144,6 +405,8 @@ def build_service_from_transitions(
 
     The set of states and the set of actions are parsed from the transition function.
     This will guarantee that all the states are reachable.
+    The result is a CompactService: the next-state distributions are interned
+    Distribution objects, shared by all the services with the same transition shapes.
 
     :param transition_function: the transition function
     :param initial_state: the initial state
@@ -164,71 +427,408 @@ def build_service_from_transitions(
     ), f"the following final states are not in the transition function: {unreachable_final_states}"
     assert initial_state in states, "initial state not in the set of states"
 
-    return Service(states, actions, final_states, initial_state, transition_function)
+    return CompactService(states, actions, final_states, initial_state, transition_function)
+
 
+DEFAULT_SYSTEM_CACHE_SIZE = 2 ** 16
 
-def build_system_service(*services: Service) -> Service:
+
+class _ProductStates(AbstractSet):
+    """A lazy view over the encoded product of sets of local states."""
+
+    def __init__(self, encoder: StateEncoder, components: Sequence[Sequence[int]]):
+        """
+        Initialize the view.
+
+        :param encoder: the state encoder
+        :param components: the local indexes allowed for each component
+        """
+        self._encoder = encoder
+        self._components = tuple(tuple(component) for component in components)
+        self._component_sets = tuple(frozenset(component) for component in components)
+
+    def __contains__(self, state: object) -> bool:
+        """Check that every component of the encoded state is allowed."""
+        encoder = self._encoder
+        return encoder.is_valid(state) and all(
+            encoder.component(state, i) in local_indexes  # type: ignore
+            for i, local_indexes in enumerate(self._component_sets)
+        )
+
+    def __iter__(self) -> Iterator[int]:
+        """Iterate over the product, without materializing it."""
+        for local_indexes in itertools.product(*self._components):
+            yield self._encoder.encode_indexes(local_indexes)
+
+    def __len__(self) -> int:
+        """Get the size of the product."""
+        result = 1
+        for component in self._components:
+            result *= len(component)
+        return result
+
+
+class _LazyTransitionFunction(Mapping):
+    """
+    The transition function of a system service, computed on demand.
+
+    The outgoing transitions of a system state are computed from the component
+    services the first time they are requested, and memoized in a bounded LRU cache.
+    """
+
+    def __init__(self, system_service: "SystemService", cache_size: int):
+        """
+        Initialize the transition function.
+
+        :param system_service: the system service
+        :param cache_size: the maximum number of system states to memoize
+        """
+        assert cache_size >= 0, "cache size must be non-negative"
+        self._system_service = system_service
+        self._cache_size = cache_size
+        self._cache: "OrderedDict[int, Dict]" = OrderedDict()
+
+    def __getitem__(self, state: int) -> Dict[Action, Tuple[Dict[int, Prob], Reward]]:
+        """Get the outgoing transitions from a system state."""
+        cache = self._cache
+        transitions = cache.get(state)
+        if transitions is not None:
+            cache.move_to_end(state)
+            return transitions
+        if state not in self._system_service.states:
+            raise KeyError(state)
+        transitions = self._system_service._compute_transitions(state)
+        if self._cache_size > 0:
+            cache[state] = transitions
+            if len(cache) > self._cache_size:
+                cache.popitem(last=False)
+        return transitions
+
+    def __contains__(self, state: object) -> bool:
+        """Check whether the state is a state of the system service."""
+        return state in self._system_service.states
+
+    def __iter__(self) -> Iterator[int]:
+        """Iterate over the system states."""
+        return iter(self._system_service.states)
+
+    def __len__(self) -> int:
+        """Get the number of system states."""
+        return len(self._system_service.states)
+
+
+class SystemService:
+    """
+    The system service of a community of services.
+
+    It exposes the same interface of a Service (states, actions, final states,
+    initial state and transition function), but the joint states and their
+    transitions are never enumerated eagerly.
+
+    The representation is factored: every joint transition changes exactly one
+    component, hence only the local dynamics of each component service are stored,
+    together with an index from actions to the services that can perform them.
+    The successors of a joint state under (action, i) are obtained by patching the
+    i-th component, so the memory is linear in the sum of the sizes of the services.
+
+    Joint states are encoded as integers (see StateEncoder); use 'decode' to get
+    the tuple of local states, e.g. for display purposes.
+    """
+
+    def __init__(
+        self, services: Sequence[Service], cache_size: int = DEFAULT_SYSTEM_CACHE_SIZE
+    ):
+        """
+        Initialize the system service.
+
+        :param services: the community of services
+        :param cache_size: the maximum number of system states whose transitions are
+          memoized by the transition function view (0 disables the cache)
+        """
+        self.services: Tuple[Service, ...] = tuple(services)
+        self.encoder = StateEncoder(
+            [_reachable_states(service) for service in self.services]
+        )
+        self.initial_state: int = self.encoder.encode(
+            [service.initial_state for service in self.services]
+        )
+        # local dynamics of each component, over local indexes:
+        # local index -> action -> (next local index -> prob, reward);
+        # the distributions are interned, so identical services share them
+        self.local_dynamics: Tuple[
+            Tuple[Dict[Action, Tuple[Distribution, Reward]], ...], ...
+        ] = tuple(
+            tuple(
+                {
+                    action: (
+                        Distribution(
+                            (self.encoder.encode_local(i, next_local_state), prob)
+                            for next_local_state, prob in next_local_states.items()
+                        ),
+                        reward,
+                    )
+                    for action, (next_local_states, reward) in service.transition_function.get(
+                        local_state, {}
+                    ).items()
+                }
+                for local_state in self.encoder.local_states[i]
+            )
+            for i, service in enumerate(self.services)
+        )
+        # index: action -> ids of the services that can perform it
+        services_by_action: Dict[Action, Set[int]] = {}
+        for i, local_dynamics in enumerate(self.local_dynamics):
+            for transitions_by_action in local_dynamics:
+                for action in transitions_by_action:
+                    services_by_action.setdefault(action, set()).add(i)
+        self.services_by_action: Dict[Action, Tuple[int, ...]] = {
+            action: tuple(sorted(service_ids))
+            for action, service_ids in services_by_action.items()
+        }
+        self.actions: Set[Action] = {
+            (action, i)
+            for action, service_ids in self.services_by_action.items()
+            for i in service_ids
+        }
+        # index: action -> (service id, stride, radix, bitmask of the local indexes that enable it)
+        self._enabledness_by_action: Dict[Action, Tuple[Tuple[int, int, int, int], ...]] = {
+            action: tuple(
+                (
+                    i,
+                    self.encoder.strides[i],
+                    self.encoder.radixes[i],
+                    sum(
+                        1 << local_index
+                        for local_index, transitions_by_action in enumerate(
+                            self.local_dynamics[i]
+                        )
+                        if action in transitions_by_action
+                    ),
+                )
+                for i in service_ids
+            )
+            for action, service_ids in self.services_by_action.items()
+        }
+        # groups of (at least two) services with identical local dynamics and final states
+        self.symmetry_groups: Tuple[Tuple[int, ...], ...] = self._find_symmetry_groups()
+        self.states = _ProductStates(
+            self.encoder, [range(radix) for radix in self.encoder.radixes]
+        )
+        self.final_states = _ProductStates(
+            self.encoder,
+            [
+                [
+                    self.encoder.encode_local(i, state)
+                    for state in self.encoder.local_states[i]
+                    if state in service.final_states
+                ]
+                for i, service in enumerate(self.services)
+            ],
+        )
+        self.transition_function = _LazyTransitionFunction(self, cache_size)
+
+    @property
+    def local_states(self) -> Tuple[Tuple[State, ...], ...]:
+        """Get the reachable local states of each component, ordered by local index."""
+        return self.encoder.local_states
+
+    def encode(self, state: Sequence[State]) -> int:
+        """Encode a tuple of local states."""
+        return self.encoder.encode(state)
+
+    def decode(self, state: int) -> Tuple[State, ...]:
+        """Decode a system state into the tuple of local states."""
+        return self.encoder.decode(state)
+
+    def local_index(self, state: int, service_id: int) -> int:
+        """Get the local index of a component of a system state."""
+        return self.encoder.component(state, service_id)
+
+    def local_transitions(
+        self, service_id: int, local_index: int
+    ) -> Dict[Action, Tuple[Distribution, Reward]]:
+        """
+        Get the outgoing transitions of a component service.
+
+        :param service_id: the index of the service in the community
+        :param local_index: the index of the state of the service
+        :return: the local transitions, indexed by action
+        """
+        return self.local_dynamics[service_id][local_index]
+
+    def enabled_actions(self, state: int) -> Iterator[Tuple[Action, int]]:
+        """
+        Iterate over the actions (action, service id) enabled in a system state.
+
+        :param state: the system state
+        :return: an iterator over the system actions
+        """
+        for i, (local_dynamics, radix) in enumerate(
+            zip(self.local_dynamics, self.encoder.radixes)
+        ):
+            state, local_index = divmod(state, radix)
+            for action in local_dynamics[local_index]:
+                yield action, i
+
+    def enabled_services(self, state: int, action: Action) -> List[int]:
+        """
+        Get the services that can perform an action in a system state.
+
+        Only the services that have the action are inspected, and whether a
+        service can perform it is a bit test on its local index.
+
+        :param state: the system state
+        :param action: the action
+        :return: the ids of the services, in increasing order
+        """
+        return [
+            service_id
+            for service_id, stride, radix, local_mask in self._enabledness_by_action.get(
+                action, ()
+            )
+            if (local_mask >> ((state // stride) % radix)) & 1
+        ]
+
+    def canonical_state(self, state: int) -> int:
+        """
+        Get the canonical representative of a system state under the symmetries.
+
+        Identical services are interchangeable: within each symmetry group, the
+        local indexes are sorted by position, so all the permutations of the
+        local states of a group have the same representative.
+
+        :param state: the system state
+        :return: the canonical system state
+        """
+        return self.canonicalize(state)[0]
+
+    def canonicalize(self, state: int) -> Tuple[int, Tuple[int, ...]]:
+        """
+        Get the canonical representative of a system state, with the permutation.
+
+        :param state: the system state
+        :return: the canonical system state, and for each service id in the canonical
+          state, the id of the service that has its local state in the given state
+        """
+        permutation = list(range(len(self.services)))
+        canonical_state = state
+        for group in self.symmetry_groups:
+            local_states = sorted(
+                (self.encoder.component(state, service_id), service_id)
+                for service_id in group
+            )
+            for position, (local_index, service_id) in zip(group, local_states):
+                canonical_state = self.encoder.replace(canonical_state, position, local_index)
+                permutation[position] = service_id
+        return canonical_state, tuple(permutation)
+
+    def symmetric_states(self, state: int) -> List[int]:
+        """
+        Get the system states with the same canonical representative of a system state.
+
+        They are all the distinct permutations of the local indexes within the symmetry groups.
+
+        :param state: the system state
+        :return: the symmetric system states, the given one included
+        """
+        states = [state]
+        for group in self.symmetry_groups:
+            local_indexes = [self.encoder.component(state, service_id) for service_id in group]
+            permuted_states = []
+            for permuted_indexes in set(itertools.permutations(local_indexes)):
+                for permuted_state in states:
+                    for service_id, local_index in zip(group, permuted_indexes):
+                        permuted_state = self.encoder.replace(permuted_state, service_id, local_index)
+                    permuted_states.append(permuted_state)
+            states = permuted_states
+        return states
+
+    def _find_symmetry_groups(self) -> Tuple[Tuple[int, ...], ...]:
+        """Group the services with the same local states, local dynamics and final states."""
+        is_final = [
+            tuple(state in service.final_states for state in self.encoder.local_states[i])
+            for i, service in enumerate(self.services)
+        ]
+        groups: List[List[int]] = []
+        for i in range(len(self.services)):
+            for group in groups:
+                j = group[0]
+                if (
+                    self.encoder.local_states[i] == self.encoder.local_states[j]
+                    and self.local_dynamics[i] == self.local_dynamics[j]
+                    and is_final[i] == is_final[j]
+                ):
+                    group.append(i)
+                    break
+            else:
+                groups.append([i])
+        return tuple(tuple(group) for group in groups if len(group) > 1)
+
+    def successors(
+        self, state: int, action: Action, service_id: int
+    ) -> Tuple[Dict[int, Prob], Reward]:
+        """
+        Get the successors of a system state when a service performs an action.
+
+        :param state: the system state
+        :param action: the action
+        :param service_id: the index of the service that performs the action
+        :return: the next system states distribution, and the reward
+        """
+        stride = self.encoder.strides[service_id]
+        local_index = (state // stride) % self.encoder.radixes[service_id]
+        next_local_indexes, reward = self.local_dynamics[service_id][local_index][
+            action
+        ]
+        base = state - local_index * stride
+        # the local dynamics are over local indexes
+        next_states = {
+            base + cast(int, next_local_index) * stride: prob
+            for next_local_index, prob in next_local_indexes.items()
+        }
+        return next_states, reward
+
+    def _compute_transitions(
+        self, current_state: int
+    ) -> Dict[Action, Tuple[Dict[int, Prob], Reward]]:
+        """Compute the outgoing transitions of a system state from its components."""
+        return {
+            (action, i): self.successors(current_state, action, i)
+            for action, i in self.enabled_actions(current_state)
+        }
+
+
+def _reachable_states(service: Service) -> Tuple[State, ...]:
+    """Get the states of a service reachable from its initial state, in BFS order."""
+    queue: Deque[State] = deque([service.initial_state])
+    discovered = {service.initial_state}
+    result = []
+    while len(queue) > 0:
+        current_state = queue.popleft()
+        result.append(current_state)
+        for next_states, _reward in service.transition_function.get(
+            current_state, {}
+        ).values():
+            for next_state in next_states:
+                if next_state not in discovered:
+                    discovered.add(next_state)
+                    queue.append(next_state)
+    return tuple(result)
+
+
+def build_system_service(
+    *services: Service, cache_size: int = DEFAULT_SYSTEM_CACHE_SIZE
+) -> SystemService:
     """
     Do the build_system_service between services.
 
+    The joint states are not enumerated: every combination of the locally reachable
+    states of the services is reachable, and the transitions of a joint state are
+    computed on demand (see SystemService).
+
     :param services: a list of service instances
+    :param cache_size: the maximum number of system states whose transitions are memoized
     :return: the system service
     """
     assert len(services) >= 2, "at least two services"
-
-    new_states: Set[State] = set()
-    new_final_states: Set[State] = set()
-    actions: Set[Action] = set()
-    new_initial_state: Tuple[State, ...] = tuple(
-        service.initial_state for service in services
-    )
-    new_transition_function: MDPDynamics = {}
-
-    queue: Deque[Tuple[State, ...]] = deque()
-    queue.append(new_initial_state)
-    to_be_visited = {new_initial_state}
-    visited = set()
-    while len(queue) > 0:
-        current_state: Tuple[State, ...] = queue.popleft()
-        to_be_visited.remove(current_state)
-        visited.add(current_state)
-
-        new_states.add(current_state)
-        #check if system_state is final
-        if all(
-            component_i in services[i].final_states
-            for i, component_i in enumerate(current_state)
-        ):
-            new_final_states.add(current_state)
-
-        next_state_template = current_state
-        for i in range(len(services)):
-            current_service: Service = services[i]
-            current_service_state = list(next_state_template)[i]
-            for a, (next_service_states, reward) in current_service.transition_function[
-                current_service_state
-            ].items():
-                symbol = (a, i)
-                actions.add(symbol)
-                new_transition_function.setdefault(current_state, {})[symbol] = (
-                    {},
-                    reward,
-                )
-                for next_service_state, prob in next_service_states.items():
-                    # we need to transform it to list temporarily
-                    next_state_list = list(next_state_template)
-                    next_state_list[i] = next_service_state
-                    next_state = tuple(next_state_list)
-                    new_transition_function[current_state][symbol][0][next_state] = prob
-                    if next_state not in visited and next_state not in to_be_visited:
-                        to_be_visited.add(next_state)
-                        queue.append(next_state)
-
-    new_service = Service(
-        states=new_states,
-        actions=actions,
-        final_states=new_final_states,
-        initial_state=new_initial_state,
-        transition_function=new_transition_function,
-    )
-    return new_service
+    return SystemService(services, cache_size=cache_size)
@@ -0,0 +1,616 @@
+"""This module implements vectorized solvers for sparse MDPs."""
+import inspect
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+from mdp_dp_rl.processes.det_policy import DetPolicy
+
+from stochastic_service_composition.sparse_mdp import SparseMDP, concat_ranges
+from stochastic_service_composition.types import State
+
+DEFAULT_TOLERANCE = 1e-4
+
+
+class SolverResult:
+    """The result of solving a SparseMDP: values, greedy policy and statistics."""
+
+    def __init__(
+        self,
+        mdp: SparseMDP,
+        values: np.ndarray,
+        policy_rows: np.ndarray,
+        iterations: int,
+        iteration_times: List[float],
+    ):
+        """
+        Initialize the result.
+
+        :param mdp: the solved MDP
+        :param values: the value of each state id
+        :param policy_rows: the row chosen in each state id
+        :param iterations: the number of iterations
+        :param iteration_times: the elapsed time of each iteration, in seconds
+        """
+        self.mdp = mdp
+        self.values = values
+        self.policy_rows = policy_rows
+        self.iterations = iterations
+        self.iteration_times = iteration_times
+
+    @property
+    def elapsed_time(self) -> float:
+        """Get the total elapsed time, in seconds."""
+        return sum(self.iteration_times)
+
+    @property
+    def policy(self) -> DetPolicy:
+        """Get the deterministic policy over state and action labels."""
+        mdp = self.mdp
+        action_ids = mdp.row_actions[self.policy_rows].tolist()
+        return DetPolicy(
+            {
+                state: mdp.actions[action_id]
+                for state, action_id in zip(mdp.states, action_ids)
+            }
+        )
+
+    def get_value_func_dict(self) -> Dict[State, float]:
+        """Get the value function over state labels."""
+        return dict(zip(self.mdp.states, self.values.tolist()))
+
+
+class _Backup:
+    """Precomputed indexes to perform Bellman backups on a SparseMDP."""
+
+    def __init__(self, mdp: SparseMDP):
+        """
+        Initialize the backup operator.
+
+        :param mdp: the sparse MDP
+        """
+        self.mdp = mdp
+        self.entry_rows = mdp.entry_rows()
+        self.row_states = mdp.row_states()
+        self.state_starts = mdp.state_ptr[:-1]
+        self.row_ids = np.arange(mdp.nb_rows, dtype=np.int64)
+        self._discounts: Dict[float, Union[float, np.ndarray]] = {}
+
+    def discounts(self, gamma: float) -> Union[float, np.ndarray]:
+        """Get the discount of each row (memoized, for MDPs with rows of several steps)."""
+        discounts = self._discounts.get(gamma)
+        if discounts is None:
+            discounts = self._discounts[gamma] = self.mdp.discounts(gamma)
+        return discounts
+
+    def q_values(self, values: np.ndarray, gamma: float) -> np.ndarray:
+        """Compute the Q-value of each row."""
+        mdp = self.mdp
+        expected = np.bincount(
+            self.entry_rows,
+            weights=mdp.probs * values[mdp.next_states],
+            minlength=mdp.nb_rows,
+        )
+        return mdp.rewards + self.discounts(gamma) * expected
+
+    def max_q(self, q_values: np.ndarray) -> np.ndarray:
+        """Compute the maximum Q-value of each state (segment reduction)."""
+        return np.maximum.reduceat(q_values, self.state_starts)
+
+    def greedy_rows(self, q_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Get, for each state, the first row that attains the given value."""
+        is_best = q_values >= values[self.row_states]
+        candidates = np.where(is_best, self.row_ids, self.mdp.nb_rows)
+        return np.minimum.reduceat(candidates, self.state_starts)
+
+
+def value_iteration(
+    mdp: SparseMDP,
+    tol: float = DEFAULT_TOLERANCE,
+    max_iterations: Optional[int] = None,
+    initial_values: Optional[np.ndarray] = None,
+) -> SolverResult:
+    """
+    Compute the optimal values and policy with value iteration.
+
+    Each Bellman backup is a sparse matrix-vector product over the CSR rows,
+    followed by a max-over-actions segment reduction.
+
+    :param mdp: the sparse MDP
+    :param tol: stop when the max change of the values is below this threshold
+    :param max_iterations: the maximum number of iterations (no limit if None)
+    :param initial_values: the initial values (zeros if None)
+    :return: the result
+    """
+    backup = _Backup(mdp)
+    return _value_iteration(backup, mdp, tol, max_iterations, initial_values)
+
+
+def _value_iteration(
+    backup: _Backup,
+    mdp: SparseMDP,
+    tol: float,
+    max_iterations: Optional[int],
+    initial_values: Optional[np.ndarray],
+) -> SolverResult:
+    """Run value iteration on an MDP that shares the transitions of the backup operator."""
+    values = (
+        np.zeros(mdp.nb_states, dtype=np.float64)
+        if initial_values is None
+        else np.array(initial_values, dtype=np.float64)
+    )
+    assert values.shape == (mdp.nb_states,), "wrong shape of the initial values"
+    iteration_times: List[float] = []
+    iterations = 0
+    while max_iterations is None or iterations < max_iterations:
+        start = time.perf_counter()
+        new_values = backup.max_q(backup.q_values(values, mdp.gamma))
+        delta = np.max(np.abs(new_values - values)) if mdp.nb_states > 0 else 0.0
+        values = new_values
+        iterations += 1
+        iteration_times.append(time.perf_counter() - start)
+        if delta < tol:
+            break
+
+    q_values = backup.q_values(values, mdp.gamma)
+    values = backup.max_q(q_values)
+    policy_rows = backup.greedy_rows(q_values, values)
+    return SolverResult(mdp, values, policy_rows, iterations, iteration_times)
+
+
+def gamma_sweep(
+    mdp: SparseMDP,
+    gammas: Sequence[float],
+    tol: float = DEFAULT_TOLERANCE,
+    max_iterations: Optional[int] = None,
+) -> List[SolverResult]:
+    """
+    Solve an MDP for several discount factors with value iteration.
+
+    The discount factors are processed in the given order; the backup indexes
+    and the transition arrays are shared, and each run starts from the values
+    of the previous one (in increasing order of gamma, they are close).
+
+    :param mdp: the sparse MDP
+    :param gammas: the discount factors
+    :param tol: stop when the max change of the values is below this threshold
+    :param max_iterations: the maximum number of iterations of each run (no limit if None)
+    :return: the results, one per discount factor; result.mdp.gamma is the discount factor
+    """
+    backup = _Backup(mdp)
+    results: List[SolverResult] = []
+    values: Optional[np.ndarray] = None
+    for gamma in gammas:
+        result = _value_iteration(
+            backup, mdp.with_gamma(gamma), tol, max_iterations, values
+        )
+        values = result.values
+        results.append(result)
+    return results
+
+
+def batched_value_iteration(
+    mdp: SparseMDP,
+    rewards: np.ndarray,
+    tol: float = DEFAULT_TOLERANCE,
+    max_iterations: Optional[int] = None,
+) -> List[SolverResult]:
+    """
+    Compute the optimal values and policies for several reward vectors at once.
+
+    The K scenarios share the transitions of the MDP; the values are an |S| x K
+    array, and each backup is a single sparse matrix-matrix product followed by
+    a max-over-actions segment reduction along the rows. The iterations stop
+    when all the scenarios have converged.
+
+    :param mdp: the sparse MDP (its own rewards are ignored)
+    :param rewards: the rewards, an array of shape (number of rows, K)
+    :param tol: stop when the max change of the values is below this threshold
+    :param max_iterations: the maximum number of iterations (no limit if None)
+    :return: the results, one per reward vector; result.mdp.rewards is the reward vector
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    if rewards.ndim == 1:
+        rewards = rewards[:, np.newaxis]
+    assert rewards.ndim == 2 and rewards.shape[0] == mdp.nb_rows, "wrong shape of the rewards"
+    nb_scenarios = rewards.shape[1]
+    transitions = scipy.sparse.csr_matrix(
+        (mdp.probs, mdp.next_states, mdp.row_ptr), shape=(mdp.nb_rows, mdp.nb_states)
+    )
+    state_starts = mdp.state_ptr[:-1]
+    discounts = mdp.discounts()
+    if isinstance(discounts, np.ndarray):
+        discounts = discounts[:, np.newaxis]
+
+    def q_values(values: np.ndarray) -> np.ndarray:
+        return rewards + discounts * (transitions @ values)
+
+    values = np.zeros((mdp.nb_states, nb_scenarios), dtype=np.float64)
+    iteration_times: List[float] = []
+    iterations = 0
+    while max_iterations is None or iterations < max_iterations:
+        start = time.perf_counter()
+        new_values = np.maximum.reduceat(q_values(values), state_starts, axis=0)
+        delta = np.max(np.abs(new_values - values)) if values.size > 0 else 0.0
+        values = new_values
+        iterations += 1
+        iteration_times.append(time.perf_counter() - start)
+        if delta < tol:
+            break
+
+    q = q_values(values)
+    values = np.maximum.reduceat(q, state_starts, axis=0)
+    is_best = q >= values[mdp.row_states()]
+    row_ids = np.arange(mdp.nb_rows, dtype=np.int64)[:, np.newaxis]
+    candidates = np.where(is_best, row_ids, mdp.nb_rows)
+    policy_rows = np.minimum.reduceat(candidates, state_starts, axis=0)
+    return [
+        SolverResult(
+            mdp.with_rewards(np.ascontiguousarray(rewards[:, k])),
+            np.ascontiguousarray(values[:, k]),
+            np.ascontiguousarray(policy_rows[:, k]),
+            iterations,
+            list(iteration_times),
+        )
+        for k in range(nb_scenarios)
+    ]
+
+
+class _PartialBackup:
+    """Bellman backups restricted to a subset of the states of a SparseMDP."""
+
+    def __init__(self, mdp: SparseMDP, state_ids: np.ndarray):
+        """
+        Initialize the partial backup operator.
+
+        :param mdp: the sparse MDP
+        :param state_ids: the (sorted) ids of the states to update
+        """
+        self.mdp = mdp
+        self.state_ids = state_ids
+        nb_rows_by_state = mdp.state_ptr[state_ids + 1] - mdp.state_ptr[state_ids]
+        self.rows = concat_ranges(mdp.state_ptr[state_ids], nb_rows_by_state)
+        nb_entries_by_row = mdp.row_ptr[self.rows + 1] - mdp.row_ptr[self.rows]
+        self.entries = concat_ranges(mdp.row_ptr[self.rows], nb_entries_by_row)
+        self.entry_rows = np.repeat(
+            np.arange(len(self.rows), dtype=np.int64), nb_entries_by_row
+        )
+        self.state_starts = np.zeros(len(state_ids), dtype=np.int64)
+        np.cumsum(nb_rows_by_state[:-1], out=self.state_starts[1:])
+        self.next_states = mdp.next_states[self.entries]
+        self.probs = mdp.probs[self.entries]
+        self.rewards = mdp.rewards[self.rows]
+        self.row_steps = None if mdp.row_steps is None else mdp.row_steps[self.rows]
+
+    def __call__(self, values: np.ndarray, gamma: float) -> float:
+        """Update the values of the states in place; return the max change."""
+        expected = np.bincount(
+            self.entry_rows,
+            weights=self.probs * values[self.next_states],
+            minlength=len(self.rows),
+        )
+        discounts = gamma if self.row_steps is None else gamma ** self.row_steps
+        new_values = np.maximum.reduceat(
+            self.rewards + discounts * expected, self.state_starts
+        )
+        delta = float(np.max(np.abs(new_values - values[self.state_ids])))
+        values[self.state_ids] = new_values
+        return delta
+
+
+class _Tarjan:
+    """An iterative version of Tarjan's algorithm, over a graph in CSR format."""
+
+    def __init__(self, indptr: List[int], indices: List[int]):
+        """
+        Initialize the search.
+
+        :param indptr: the offsets of the successors of each node
+        :param indices: the successors
+        """
+        self.indptr = indptr
+        self.indices = indices
+        nb_nodes = len(indptr) - 1
+        self.index = [-1] * nb_nodes
+        self.lowlink = [0] * nb_nodes
+        self.on_stack = [False] * nb_nodes
+        self.stack: List[int] = []
+        self.components: List[List[int]] = []
+        self.counter = 0
+
+    def _discover(self, node: int) -> None:
+        """Assign the next index to a node and push it on the stack."""
+        self.index[node] = self.lowlink[node] = self.counter
+        self.counter += 1
+        self.stack.append(node)
+        self.on_stack[node] = True
+
+    def _advance(self, node: int, position: int) -> Optional[int]:
+        """
+        Scan the successors of a node from a position, until an undiscovered one.
+
+        :param node: the node
+        :param position: the position of the next successor to scan
+        :return: the position after the first undiscovered successor, or None if there is none
+        """
+        index = self.index
+        lowlink = self.lowlink
+        indices = self.indices
+        end = self.indptr[node + 1]
+        while position < end:
+            successor = indices[position]
+            position += 1
+            if index[successor] == -1:
+                return position
+            if self.on_stack[successor] and index[successor] < lowlink[node]:
+                lowlink[node] = index[successor]
+        return None
+
+    def _pop_component(self, root: int) -> None:
+        """Pop the component of a root node from the stack."""
+        component = []
+        while True:
+            node = self.stack.pop()
+            self.on_stack[node] = False
+            component.append(node)
+            if node == root:
+                break
+        self.components.append(component)
+
+    def visit(self, root: int) -> None:
+        """Visit the nodes reachable from an undiscovered root node."""
+        self._discover(root)
+        work = [(root, self.indptr[root])]
+        while len(work) > 0:
+            node, position = work[-1]
+            next_position = self._advance(node, position)
+            if next_position is not None:
+                # visit the successor first
+                successor = self.indices[next_position - 1]
+                work[-1] = (node, next_position)
+                self._discover(successor)
+                work.append((successor, self.indptr[successor]))
+                continue
+            # all the successors of the node have been visited
+            work.pop()
+            if self.lowlink[node] == self.index[node]:
+                self._pop_component(node)
+            if len(work) > 0:
+                parent = work[-1][0]
+                if self.lowlink[node] < self.lowlink[parent]:
+                    self.lowlink[parent] = self.lowlink[node]
+
+
+def strongly_connected_components(mdp: SparseMDP) -> List[List[int]]:
+    """
+    Compute the strongly connected components of the graph of an MDP.
+
+    It is an iterative version of Tarjan's algorithm; the components are returned
+    in reverse topological order, i.e. every component comes after all the
+    components reachable from it.
+
+    :param mdp: the sparse MDP
+    :return: the list of components, each one a list of state ids
+    """
+    indptr, indices = mdp.state_graph()
+    tarjan = _Tarjan(indptr.tolist(), indices.tolist())
+    for root in range(mdp.nb_states):
+        if tarjan.index[root] == -1:
+            tarjan.visit(root)
+    return tarjan.components
+
+
+def _component_layers(
+    mdp: SparseMDP, components: List[List[int]]
+) -> Dict[int, Dict[bool, List[int]]]:
+    """
+    Group the states of the components in layers of independent components.
+
+    The layer of a component is 1 + the max layer of the components it can reach;
+    within a layer, the states of the cyclic and of the acyclic components are
+    kept apart.
+
+    :param mdp: the sparse MDP
+    :param components: the components, in reverse topological order
+    :return: the map layer -> is cyclic -> state ids
+    """
+    indptr, indices = (array_.tolist() for array_ in mdp.state_graph())
+    component_of = [0] * mdp.nb_states
+    for component_id, component in enumerate(components):
+        for state_id in component:
+            component_of[state_id] = component_id
+
+    layers = [0] * len(components)
+    states_by_layer: Dict[int, Dict[bool, List[int]]] = {}
+    for component_id, component in enumerate(components):
+        layer = 0
+        cyclic = len(component) > 1
+        for state_id in component:
+            for next_state_id in indices[indptr[state_id]:indptr[state_id + 1]]:
+                next_component_id = component_of[next_state_id]
+                if next_component_id == component_id:
+                    cyclic = True
+                else:
+                    layer = max(layer, layers[next_component_id] + 1)
+        layers[component_id] = layer
+        states_by_layer.setdefault(layer, {}).setdefault(cyclic, []).extend(component)
+    return states_by_layer
+
+
+def _solve_states(
+    mdp: SparseMDP,
+    values: np.ndarray,
+    state_ids: List[int],
+    cyclic: bool,
+    tol: float,
+    max_iterations: Optional[int],
+) -> int:
+    """
+    Update in place the values of states whose successors are solved, or in the same states.
+
+    :param mdp: the sparse MDP
+    :param values: the values, updated in place
+    :param state_ids: the states to solve
+    :param cyclic: whether the states belong to cyclic components (otherwise, a single backup is enough)
+    :param tol: the convergence threshold of the value iteration
+    :param max_iterations: the maximum number of iterations (no limit if None)
+    :return: the number of backups
+    """
+    partial_backup = _PartialBackup(mdp, np.array(sorted(state_ids), dtype=np.int64))
+    iterations = 0
+    while True:
+        delta = partial_backup(values, mdp.gamma)
+        iterations += 1
+        if not cyclic or delta < tol:
+            break
+        if max_iterations is not None and iterations >= max_iterations:
+            break
+    return iterations
+
+
+def topological_value_iteration(
+    mdp: SparseMDP,
+    tol: float = DEFAULT_TOLERANCE,
+    max_iterations: Optional[int] = None,
+) -> SolverResult:
+    """
+    Compute the optimal values and policy exploiting the SCC structure of the MDP.
+
+    The MDP is decomposed into strongly connected components, which are solved
+    in reverse topological order: a component is solved once all the components
+    it can reach are. Components are grouped in layers of independent components,
+    each layer is updated with vectorized backups; acyclic components need a
+    single backup, while value iteration runs only on the cyclic ones.
+
+    :param mdp: the sparse MDP
+    :param tol: the convergence threshold of the local value iterations
+    :param max_iterations: the maximum number of iterations per layer (no limit if None)
+    :return: the result; 'iterations' is the total number of backups per layer
+    """
+    start = time.perf_counter()
+    states_by_layer = _component_layers(mdp, strongly_connected_components(mdp))
+    iteration_times = [time.perf_counter() - start]
+
+    values = np.zeros(mdp.nb_states, dtype=np.float64)
+    iterations = 0
+    for layer in sorted(states_by_layer):
+        start = time.perf_counter()
+        for cyclic, state_ids in sorted(states_by_layer[layer].items()):
+            iterations += _solve_states(mdp, values, state_ids, cyclic, tol, max_iterations)
+        iteration_times.append(time.perf_counter() - start)
+
+    backup = _Backup(mdp)
+    q_values = backup.q_values(values, mdp.gamma)
+    policy_rows = backup.greedy_rows(q_values, backup.max_q(q_values))
+    return SolverResult(mdp, values, policy_rows, iterations, iteration_times)
+
+
+# scipy < 1.12 calls the relative tolerance of the iterative solvers 'tol'
+_BICGSTAB_RTOL = (
+    "rtol" if "rtol" in inspect.signature(scipy.sparse.linalg.bicgstab).parameters else "tol"
+)
+
+POLICY_EVALUATION_DIRECT = "direct"
+POLICY_EVALUATION_ITERATIVE = "iterative"
+
+
+def evaluate_policy(
+    mdp: SparseMDP,
+    policy_rows: np.ndarray,
+    method: str = POLICY_EVALUATION_DIRECT,
+    tol: float = DEFAULT_TOLERANCE,
+    initial_values: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Compute the values of a deterministic policy, solving (I - gamma P) v = r.
+
+    For MDPs with rows of several steps, each row of P is scaled by its own discount.
+
+    :param mdp: the sparse MDP
+    :param policy_rows: the row chosen in each state id
+    :param method: 'direct' (sparse LU) or 'iterative' (BiCGSTAB)
+    :param tol: the absolute tolerance of the iterative solver
+    :param initial_values: the initial guess of the iterative solver
+    :return: the values of the policy
+    """
+    assert method in (
+        POLICY_EVALUATION_DIRECT,
+        POLICY_EVALUATION_ITERATIVE,
+    ), f"unknown policy evaluation method: {method}"
+    nb_entries_by_row = mdp.row_ptr[policy_rows + 1] - mdp.row_ptr[policy_rows]
+    entries = concat_ranges(mdp.row_ptr[policy_rows], nb_entries_by_row)
+    indptr = np.zeros(mdp.nb_states + 1, dtype=np.int64)
+    np.cumsum(nb_entries_by_row, out=indptr[1:])
+    discounts = mdp.discounts()
+    entry_discounts = (
+        np.repeat(discounts[policy_rows], nb_entries_by_row)
+        if isinstance(discounts, np.ndarray)
+        else discounts
+    )
+    discounted_transitions = scipy.sparse.csr_matrix(
+        (entry_discounts * mdp.probs[entries], mdp.next_states[entries], indptr),
+        shape=(mdp.nb_states, mdp.nb_states),
+    )
+    system = scipy.sparse.identity(mdp.nb_states, format="csr") - discounted_transitions
+    rewards = mdp.rewards[policy_rows]
+    if method == POLICY_EVALUATION_ITERATIVE:
+        # the stopping rule is on the residual alone, the relative tolerance is disabled
+        atol = tol * (1.0 - mdp.gamma) if mdp.gamma < 1.0 else tol
+        values, info = scipy.sparse.linalg.bicgstab(
+            system, rewards, x0=initial_values, atol=atol, **{_BICGSTAB_RTOL: 0.0}
+        )
+        if info == 0:
+            return values
+    return scipy.sparse.linalg.spsolve(system.tocsc(), rewards)
+
+
+def policy_iteration(
+    mdp: SparseMDP,
+    tol: float = DEFAULT_TOLERANCE,
+    max_iterations: Optional[int] = None,
+    method: str = POLICY_EVALUATION_DIRECT,
+    initial_policy_rows: Optional[np.ndarray] = None,
+) -> SolverResult:
+    """
+    Compute the optimal values and policy with policy iteration.
+
+    Each policy is evaluated exactly by solving a sparse linear system, and then
+    improved greedily; the action of a state changes only if the improvement of
+    its Q-value is greater than 'tol', so the procedure terminates in a handful
+    of iterations also for discount factors close to 1.
+
+    :param mdp: the sparse MDP
+    :param tol: the minimum Q-value improvement to change the action of a state
+    :param max_iterations: the maximum number of iterations (no limit if None)
+    :param method: the policy evaluation method, 'direct' or 'iterative'
+    :param initial_policy_rows: the initial policy (the first action of each state if None)
+    :return: the result; 'iteration_times' has the time of each evaluation-improvement step
+    """
+    backup = _Backup(mdp)
+    policy_rows = (
+        mdp.state_ptr[:-1].copy()
+        if initial_policy_rows is None
+        else np.array(initial_policy_rows, dtype=np.int64)
+    )
+    values: Optional[np.ndarray] = None
+    iteration_times: List[float] = []
+    iterations = 0
+    while max_iterations is None or iterations < max_iterations:
+        start = time.perf_counter()
+        values = evaluate_policy(mdp, policy_rows, method, tol, initial_values=values)
+        q_values = backup.q_values(values, mdp.gamma)
+        best_values = backup.max_q(q_values)
+        to_improve = best_values > q_values[policy_rows] + tol
+        if np.any(to_improve):
+            greedy_rows = backup.greedy_rows(q_values, best_values)
+            policy_rows = np.where(to_improve, greedy_rows, policy_rows)
+        iterations += 1
+        iteration_times.append(time.perf_counter() - start)
+        if not np.any(to_improve):
+            break
+
+    if values is None:
+        values = evaluate_policy(mdp, policy_rows, method, tol)
+    return SolverResult(mdp, values, policy_rows, iterations, iteration_times)
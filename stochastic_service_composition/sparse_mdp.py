@@ -0,0 +1,490 @@
+"""This module implements a compact sparse (CSR) representation of MDPs."""
+from array import array
+from typing import Dict, Hashable, List, Mapping, Optional, Tuple, Union
+
+import numpy as np
+from mdp_dp_rl.processes.mdp import MDP
+
+from stochastic_service_composition.encoding import StateEncoder
+from stochastic_service_composition.types import Action, MDPDynamics, Prob, Reward, State
+
+
+class SparseMDP:
+    """
+    A compact sparse representation of an MDP.
+
+    States and actions are identified by their index in the 'states' and 'actions'
+    tables. Every state has one or more rows, one per available action; the rows
+    of state s are the indexes in [state_ptr[s], state_ptr[s + 1]). Each row r
+    has an action label 'row_actions[r]', a reward 'rewards[r]', and a next-state
+    distribution stored in CSR format: the entries in [row_ptr[r], row_ptr[r + 1])
+    of 'next_states' and 'probs'.
+
+    Rows may span several steps (e.g. macro-transitions): if 'row_steps' is not
+    None, the next states of row r are discounted by gamma ** row_steps[r]
+    instead of gamma.
+
+    The states of a symmetry-reduced composition MDP stand for all the system
+    states with the same canonical representative: 'symmetry_groups' are the
+    groups of identical services that were merged (empty if none).
+    """
+
+    def __init__(
+        self,
+        states: List[State],
+        actions: List[Action],
+        state_ptr: np.ndarray,
+        row_actions: np.ndarray,
+        row_ptr: np.ndarray,
+        next_states: np.ndarray,
+        probs: np.ndarray,
+        rewards: np.ndarray,
+        gamma: float,
+        initial_state: Optional[State] = None,
+        state_encoder: Optional[StateEncoder] = None,
+        row_steps: Optional[np.ndarray] = None,
+        symmetry_groups: Tuple[Tuple[int, ...], ...] = (),
+    ):
+        """
+        Initialize the sparse MDP.
+
+        :param states: the state labels, indexed by state id
+        :param actions: the action labels, indexed by action id
+        :param state_ptr: the offsets of the rows of each state (size |S| + 1)
+        :param row_actions: the action id of each row (size |SA|)
+        :param row_ptr: the offsets of the entries of each row (size |SA| + 1)
+        :param next_states: the next state id of each entry
+        :param probs: the probability of each entry
+        :param rewards: the reward of each row
+        :param gamma: the discount factor
+        :param initial_state: the initial state label, if any
+        :param state_encoder: the encoder of the system states in the state labels, if any
+        :param row_steps: the number of steps of each row (one step each if None)
+        :param symmetry_groups: the groups of identical services merged in the states, if any
+        """
+        self.states = states
+        self.actions = actions
+        self.state_ptr = state_ptr
+        self.row_actions = row_actions
+        self.row_ptr = row_ptr
+        self.next_states = next_states
+        self.probs = probs
+        self.rewards = rewards
+        self.gamma = gamma
+        self.initial_state = initial_state
+        self.state_encoder = state_encoder
+        self.row_steps = row_steps
+        self.symmetry_groups = symmetry_groups
+        self._state_index: Optional[Dict[State, int]] = None
+
+        self._check_consistency()
+
+    def _check_consistency(self):
+        """Check that the arrays have consistent sizes."""
+        assert len(self.state_ptr) == len(self.states) + 1, "wrong size of state_ptr"
+        assert len(self.row_ptr) == len(self.row_actions) + 1, "wrong size of row_ptr"
+        assert len(self.rewards) == len(self.row_actions), "wrong size of rewards"
+        assert len(self.next_states) == len(self.probs), "wrong size of probs"
+        assert self.state_ptr[-1] == len(self.row_actions), "state_ptr does not cover all rows"
+        assert self.row_ptr[-1] == len(self.next_states), "row_ptr does not cover all entries"
+        assert np.all(np.diff(self.state_ptr) > 0), "every state must have an action"
+        assert self.row_steps is None or len(self.row_steps) == len(
+            self.row_actions
+        ), "wrong size of row_steps"
+
+    @property
+    def nb_states(self) -> int:
+        """Get the number of states."""
+        return len(self.states)
+
+    @property
+    def nb_rows(self) -> int:
+        """Get the number of (state, action) rows."""
+        return len(self.row_actions)
+
+    @property
+    def nb_transitions(self) -> int:
+        """Get the number of (state, action, next state) entries."""
+        return len(self.next_states)
+
+    @property
+    def nbytes(self) -> int:
+        """Get the number of bytes of the transition arrays."""
+        return sum(
+            array_.nbytes
+            for array_ in (
+                self.state_ptr,
+                self.row_actions,
+                self.row_ptr,
+                self.next_states,
+                self.probs,
+                self.rewards,
+            )
+        ) + (0 if self.row_steps is None else self.row_steps.nbytes)
+
+    @property
+    def state_index(self) -> Dict[State, int]:
+        """Get the index from state labels to state ids (built on first access)."""
+        if self._state_index is None:
+            self._state_index = {state: i for i, state in enumerate(self.states)}
+        return self._state_index
+
+    @property
+    def all_states(self) -> List[State]:
+        """Get the state labels (same name as in mdp_dp_rl's MDP)."""
+        return self.states
+
+    def discounts(self, gamma: Optional[float] = None) -> Union[float, np.ndarray]:
+        """
+        Get the discount of the next states of each row.
+
+        :param gamma: the discount factor (the one of the MDP if None)
+        :return: gamma, if every row is a single step; otherwise gamma ** row_steps
+        """
+        if gamma is None:
+            gamma = self.gamma
+        if self.row_steps is None:
+            return gamma
+        return gamma ** self.row_steps
+
+    def row_states(self) -> np.ndarray:
+        """Get the state id of each row."""
+        return np.repeat(
+            np.arange(self.nb_states, dtype=np.int64), np.diff(self.state_ptr)
+        )
+
+    def entry_rows(self) -> np.ndarray:
+        """Get the row of each entry."""
+        return np.repeat(np.arange(self.nb_rows, dtype=np.int64), np.diff(self.row_ptr))
+
+    def state_graph(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the graph of the MDP over state ids, in CSR format.
+
+        The successors of state s are indices[indptr[s]:indptr[s + 1]]
+        (possibly with repetitions, one per entry of each row of s).
+
+        :return: the pair (indptr, indices)
+        """
+        return self.row_ptr[self.state_ptr], self.next_states
+
+    def __getstate__(self):
+        """Do not pickle the state index, it can be rebuilt."""
+        state = dict(self.__dict__)
+        state["_state_index"] = None
+        return state
+
+    def __setstate__(self, state):
+        """Restore a pickled MDP (the pickles of older versions have no row steps and symmetries)."""
+        state.setdefault("row_steps", None)
+        state.setdefault("symmetry_groups", ())
+        self.__dict__.update(state)
+
+    def with_gamma(self, gamma: float) -> "SparseMDP":
+        """
+        Get a view of the MDP with another discount factor.
+
+        The view shares the transition arrays with this MDP (no copy).
+
+        :param gamma: the discount factor
+        :return: the sparse MDP
+        """
+        return self._view(gamma, self.rewards)
+
+    def with_rewards(self, rewards: np.ndarray) -> "SparseMDP":
+        """
+        Get a view of the MDP with other rewards.
+
+        The view shares the transition arrays with this MDP (no copy).
+
+        :param rewards: the reward of each row
+        :return: the sparse MDP
+        """
+        return self._view(self.gamma, rewards)
+
+    def _view(self, gamma: float, rewards: np.ndarray) -> "SparseMDP":
+        """Get a view of the MDP with the given discount factor and rewards."""
+        result = SparseMDP(
+            self.states,
+            self.actions,
+            self.state_ptr,
+            self.row_actions,
+            self.row_ptr,
+            self.next_states,
+            self.probs,
+            rewards,
+            gamma,
+            initial_state=self.initial_state,
+            state_encoder=self.state_encoder,
+            row_steps=self.row_steps,
+            symmetry_groups=self.symmetry_groups,
+        )
+        result._state_index = self._state_index
+        return result
+
+    def to_dynamics(self) -> MDPDynamics:
+        """Get the MDP dynamics as nested dictionaries, over state labels."""
+        assert self.row_steps is None, "the dynamics cannot represent rows of several steps"
+        states = self.states
+        actions = self.actions
+        state_ptr = self.state_ptr.tolist()
+        row_actions = self.row_actions.tolist()
+        row_ptr = self.row_ptr.tolist()
+        next_states = self.next_states.tolist()
+        probs = self.probs.tolist()
+        rewards = self.rewards.tolist()
+        dynamics: MDPDynamics = {}
+        for state_id, state in enumerate(states):
+            transitions = dynamics.setdefault(state, {})
+            for row in range(state_ptr[state_id], state_ptr[state_id + 1]):
+                start, end = row_ptr[row], row_ptr[row + 1]
+                transitions[actions[row_actions[row]]] = (
+                    {
+                        states[next_state]: prob
+                        for next_state, prob in zip(
+                            next_states[start:end], probs[start:end]
+                        )
+                    },
+                    rewards[row],
+                )
+        return dynamics
+
+    def to_mdp(self) -> MDP:
+        """
+        Convert to an mdp_dp_rl MDP.
+
+        The attributes 'initial_state' and 'state_encoder' (if any) are preserved.
+
+        :return: the MDP object
+        """
+        result = MDP(self.to_dynamics(), self.gamma)
+        if self.initial_state is not None:
+            result.initial_state = self.initial_state
+        if self.state_encoder is not None:
+            result.state_encoder = self.state_encoder
+        return result
+
+    @classmethod
+    def from_dynamics(
+        cls,
+        dynamics: Mapping[State, Mapping[Action, Tuple[Mapping[State, Prob], Reward]]],
+        gamma: float,
+        initial_state: Optional[State] = None,
+        state_encoder: Optional[StateEncoder] = None,
+    ) -> "SparseMDP":
+        """
+        Build a sparse MDP from nested dictionaries.
+
+        :param dynamics: the MDP dynamics
+        :param gamma: the discount factor
+        :param initial_state: the initial state, if any
+        :param state_encoder: the encoder of the system states, if any
+        :return: the sparse MDP
+        """
+        builder = SparseMDPBuilder()
+        for state in dynamics:
+            builder.add_state(state)
+        for state, transitions in dynamics.items():
+            builder.add_transitions(state, transitions)
+        return builder.build(
+            gamma, initial_state=initial_state, state_encoder=state_encoder
+        )
+
+    @classmethod
+    def from_mdp(cls, mdp: MDP) -> "SparseMDP":
+        """
+        Build a sparse MDP from an mdp_dp_rl MDP.
+
+        :param mdp: the MDP object
+        :return: the sparse MDP
+        """
+        dynamics = {
+            state: {
+                action: (next_states, mdp.rewards[state][action])
+                for action, next_states in mdp.transitions[state].items()
+            }
+            for state in mdp.transitions
+        }
+        return cls.from_dynamics(
+            dynamics,
+            mdp.gamma,
+            initial_state=getattr(mdp, "initial_state", None),
+            state_encoder=getattr(mdp, "state_encoder", None),
+        )
+
+
+class SparseMDPBuilder:
+    """
+    Incremental builder of a SparseMDP.
+
+    States get an id the first time they are added (or referenced as next
+    states); their transitions can be added later, in any order, but exactly
+    once per state. The data is accumulated in typed arrays, so the memory per
+    transition is a few machine words rather than Python objects.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the builder."""
+        self.states: List[State] = []
+        self.state_index: Dict[State, int] = {}
+        self._actions: List[Action] = []
+        self._action_index: Dict[Hashable, int] = {}
+        self._row_states = array("q")
+        self._row_actions = array("q")
+        self._row_lengths = array("q")
+        self._rewards = array("d")
+        self._next_states = array("q")
+        self._probs = array("d")
+        self._row_steps = array("q")
+
+    @property
+    def nb_states(self) -> int:
+        """Get the number of states added so far."""
+        return len(self.states)
+
+    def add_state(self, state: State) -> Tuple[int, bool]:
+        """
+        Add a state, if not already present.
+
+        :param state: the state label
+        :return: the state id, and whether the state is new
+        """
+        state_id = self.state_index.get(state)
+        if state_id is not None:
+            return state_id, False
+        state_id = len(self.states)
+        self.states.append(state)
+        self.state_index[state] = state_id
+        return state_id, True
+
+    def _action_id(self, action: Action) -> int:
+        """Get the id of an action label."""
+        action_id = self._action_index.get(action)
+        if action_id is None:
+            action_id = len(self._actions)
+            self._actions.append(action)
+            self._action_index[action] = action_id
+        return action_id
+
+    def add_row(
+        self,
+        state_id: int,
+        action: Action,
+        next_states: Mapping[int, Prob],
+        reward: Reward,
+        steps: int = 1,
+    ) -> int:
+        """
+        Add a (state, action) row, with next states given by id.
+
+        :param state_id: the state id
+        :param action: the action label
+        :param next_states: the distribution over next state ids
+        :param reward: the reward
+        :param steps: the number of steps of the row
+        :return: the row id
+        """
+        row = len(self._row_states)
+        self._row_states.append(state_id)
+        self._row_actions.append(self._action_id(action))
+        self._row_lengths.append(len(next_states))
+        self._rewards.append(reward)
+        self._row_steps.append(steps)
+        for next_state_id, prob in next_states.items():
+            self._next_states.append(next_state_id)
+            self._probs.append(prob)
+        return row
+
+    def add_transitions(
+        self,
+        state: State,
+        transitions: Mapping[Action, Tuple[Mapping[State, Prob], Reward]],
+    ) -> None:
+        """
+        Add the outgoing transitions of a state, with next states given by label.
+
+        :param state: the state label
+        :param transitions: the transitions, indexed by action
+        """
+        state_id, _ = self.add_state(state)
+        for action, (next_states, reward) in transitions.items():
+            self.add_row(
+                state_id,
+                action,
+                {self.add_state(next_state)[0]: prob for next_state, prob in next_states.items()},
+                reward,
+            )
+
+    def build(
+        self,
+        gamma: float,
+        initial_state: Optional[State] = None,
+        state_encoder: Optional[StateEncoder] = None,
+        symmetry_groups: Tuple[Tuple[int, ...], ...] = (),
+    ) -> SparseMDP:
+        """
+        Build the sparse MDP.
+
+        :param gamma: the discount factor
+        :param initial_state: the initial state, if any
+        :param state_encoder: the encoder of the system states, if any
+        :param symmetry_groups: the groups of identical services merged in the states, if any
+        :return: the sparse MDP
+        """
+        row_states = np.array(self._row_states, dtype=np.int64)
+        row_lengths = np.array(self._row_lengths, dtype=np.int64)
+        row_actions = np.array(self._row_actions, dtype=np.int32)
+        rewards = np.array(self._rewards, dtype=np.float64)
+        next_states = np.array(self._next_states, dtype=np.int64)
+        probs = np.array(self._probs, dtype=np.float64)
+        row_steps = np.array(self._row_steps, dtype=np.int64)
+
+        entry_ptr = np.zeros(len(row_lengths) + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=entry_ptr[1:])
+        if np.any(row_states[1:] < row_states[:-1]):
+            # rows were not added in state order: sort them, together with their entries.
+            order = np.argsort(row_states, kind="stable")
+            entry_order = concat_ranges(entry_ptr[order], row_lengths[order])
+            row_states = row_states[order]
+            row_lengths = row_lengths[order]
+            row_actions = row_actions[order]
+            rewards = rewards[order]
+            row_steps = row_steps[order]
+            next_states = next_states[entry_order]
+            probs = probs[entry_order]
+            entry_ptr = np.zeros(len(row_lengths) + 1, dtype=np.int64)
+            np.cumsum(row_lengths, out=entry_ptr[1:])
+
+        nb_states = len(self.states)
+        state_ptr = np.zeros(nb_states + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_states, minlength=nb_states), out=state_ptr[1:])
+        missing = np.flatnonzero(np.diff(state_ptr) == 0)
+        assert len(missing) == 0, (
+            f"the following states have no transitions: "
+            f"{[self.states[i] for i in missing[:10]]}"
+        )
+        return SparseMDP(
+            list(self.states),
+            list(self._actions),
+            state_ptr,
+            row_actions,
+            entry_ptr,
+            next_states.astype(np.int32) if nb_states < 2 ** 31 else next_states,
+            probs,
+            rewards,
+            gamma,
+            initial_state=initial_state,
+            state_encoder=state_encoder,
+            row_steps=row_steps if np.any(row_steps != 1) else None,
+            symmetry_groups=symmetry_groups,
+        )
+
+
+def concat_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenate the integer ranges [start, start + length)."""
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    return np.repeat(starts - offsets, lengths) + np.arange(total, dtype=np.int64)
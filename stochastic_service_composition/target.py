@@ -1,9 +1,17 @@
 """Represent a target service."""
-from typing import Dict, Set
+import itertools
+from array import array
+from typing import Callable, Dict, List, Set
 
 from pythomata import SimpleDFA
 
-from stochastic_service_composition.services import Service
+from stochastic_service_composition.services import (
+    Service,
+    _index_labels,
+    _index_rows,
+    _LabelSet,
+    _RowTable,
+)
 from stochastic_service_composition.types import (
     Action,
     Prob,
@@ -17,6 +25,8 @@ from stochastic_service_composition.types import (
 class Target(Service):
     """Represent a target service."""
 
+    __slots__ = ("policy", "reward")
+
     def __init__(
         self,
         states: Set[State],
@@ -99,6 +109,108 @@ class Target(Service):
                 ), f"reward {reward} is not an instance of float"
 
 
+class CompactTarget(Target):
+    """
+    A target service with array-backed states, actions and transitions.
+
+    As in CompactService, states and actions are stored in index tables, and
+    the transitions are flat rows, one per (state, action) pair and grouped by
+    state, with an action id, a next state id, the probability of the action
+    in the user's policy and the reward. 'states', 'actions',
+    'transition_function', 'policy' and 'reward' are read-only views, built once.
+    """
+
+    __slots__ = (
+        "_state_labels",
+        "_state_ids",
+        "_action_labels",
+        "_action_ids",
+        "_state_ptr",
+        "_row_actions",
+        "_row_next_states",
+        "_row_probs",
+        "_row_rewards",
+    )
+
+    def __init__(
+        self,
+        states: Set[State],
+        actions: Set[Action],
+        final_states: Set[State],
+        initial_state: State,
+        transition_function: Dict[State, Dict[Action, State]],
+        policy: Dict[State, Dict[Action, float]],
+        reward: Dict[State, Dict[Action, float]],
+    ):
+        """
+        Initialize the target service.
+
+        There is a row for every transition; the actions missing from the policy
+        or from the reward function get probability 0 and reward 0.
+
+        :param states: the set of states
+        :param actions: the set of actions
+        :param final_states: the final states
+        :param initial_state: the initial state
+        :param transition_function: the transition function
+        :param policy: the user's policy
+        :param reward: the reward function
+        """
+        self._state_labels, self._state_ids = _index_labels(
+            itertools.chain(
+                transition_function,
+                (
+                    next_state
+                    for next_state_by_action in transition_function.values()
+                    for next_state in next_state_by_action.values()
+                ),
+            ),
+            sorted(states, key=repr),
+        )
+        self._action_labels, self._action_ids = _index_labels(
+            (
+                action
+                for next_state_by_action in transition_function.values()
+                for action in next_state_by_action
+            ),
+            sorted(actions, key=repr),
+        )
+        self._state_ptr = array("q", [0])
+        self._row_actions = array("q")
+        self._row_next_states = array("q")
+        self._row_probs = array("d")
+        self._row_rewards = array("d")
+        for state in self._state_labels:
+            for action, next_state in transition_function.get(state, {}).items():
+                self._row_actions.append(self._action_ids[action])
+                self._row_next_states.append(self._state_ids[next_state])
+                self._row_probs.append(policy.get(state, {}).get(action, 0.0))
+                self._row_rewards.append(reward.get(state, {}).get(action, 0.0))
+            self._state_ptr.append(len(self._row_actions))
+        self.final_states = frozenset(final_states)  # type: ignore
+        self.initial_state = initial_state
+        self.states = _LabelSet(self._state_labels, self._state_ids)  # type: ignore
+        self.actions = _LabelSet(self._action_labels, self._action_ids)  # type: ignore
+        # the three views share the index from the actions to the rows of each state
+        state_rows = _index_rows(self._action_labels, self._state_ptr, self._row_actions)
+        # state -> action -> next state
+        self.transition_function = self._rows(state_rows, self._next_state)  # type: ignore
+        # state -> action -> probability
+        self.policy = self._rows(state_rows, self._row_probs.__getitem__)  # type: ignore
+        # state -> action -> reward
+        self.reward = self._rows(state_rows, self._row_rewards.__getitem__)  # type: ignore
+
+    def _rows(
+        self, state_rows: List[Dict[Action, int]], value: Callable[[int], object]
+    ) -> _RowTable:
+        """Get a view over the rows, with the given value of each row."""
+        return _RowTable(self._state_labels, self._state_ids, state_rows, value)
+
+    def _next_state(self, row: int) -> State:
+        """Get the next state of a row."""
+        return self._state_labels[self._row_next_states[row]]
+
+
 def build_target_from_transitions(
     dynamics_function: TargetDynamics,
     initial_state: State,
@@ -138,7 +250,7 @@ def build_target_from_transitions(
     ), f"the following final states are not in the transition function: {unreachable_final_states}"
     assert initial_state in states, "initial state not in the set of states"
 
-    return Target(
+    return CompactTarget(
         states,
         actions,
         final_states,
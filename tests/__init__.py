@@ -0,0 +1 @@
+"""Tests for the stochastic_service_composition package."""
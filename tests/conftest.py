@@ -0,0 +1,54 @@
+"""Fixtures for the tests: a tiny composition problem."""
+from typing import List, cast
+
+import pytest
+from pythomata import SimpleDFA
+
+from stochastic_service_composition.composition_mdp import comp_mdp
+from stochastic_service_composition.services import (
+    Service,
+    build_service_from_transitions,
+)
+from stochastic_service_composition.sparse_mdp import SparseMDP
+from stochastic_service_composition.types import MDPDynamics
+
+GAMMA = 0.9
+
+
+def _breakable_service(action: str, broken_prob: float, repair_reward: float) -> Service:
+    """Build a service that can break while doing its action, and must be checked afterwards."""
+    transitions: MDPDynamics = {
+        "available": {action: ({"done": 1.0 - broken_prob, "broken": broken_prob}, -1.0)},
+        "done": {f"check_{action}": ({"available": 1.0}, 0.0)},
+        "broken": {f"check_{action}": ({"available": 1.0}, repair_reward)},
+    }
+    return build_service_from_transitions(transitions, "available", {"available"})
+
+
+@pytest.fixture
+def services() -> List[Service]:
+    """Get the community of services: two identical breakable services and two single-state services."""
+    return [
+        build_service_from_transitions(
+            {"ready": {"a": ({"ready": 1.0}, -1.0)}}, "ready", {"ready"}
+        ),
+        build_service_from_transitions(
+            {"ready": {"a": ({"ready": 1.0}, -3.0)}}, "ready", {"ready"}
+        ),
+        _breakable_service("b", 0.1, -20.0),
+        _breakable_service("b", 0.1, -20.0),
+        _breakable_service("c", 0.3, -5.0),
+    ]
+
+
+@pytest.fixture
+def dfa() -> SimpleDFA:
+    """Get the goal: 'a', one or more 'b', then 'c'."""
+    transitions = {0: {"a": 1}, 1: {"b": 2}, 2: {"b": 2, "c": 3}}
+    return SimpleDFA({0, 1, 2, 3}, {"a", "b", "c"}, 0, {3}, transitions)
+
+
+@pytest.fixture
+def mdp(dfa: SimpleDFA, services: List[Service]) -> SparseMDP:
+    """Get the sparse composition MDP of the goal and the services."""
+    return cast(SparseMDP, comp_mdp(dfa, services, gamma=GAMMA, sparse=True))
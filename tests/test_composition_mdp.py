@@ -0,0 +1,94 @@
+"""Tests for the composition MDP of a DFA goal."""
+from typing import List, cast
+
+import numpy as np
+import pytest
+from pythomata import SimpleDFA
+
+from stochastic_service_composition.composition_mdp import (
+    comp_mdp,
+    lift_symmetric_policy,
+    update_service,
+)
+from stochastic_service_composition.reductions import compress_chains
+from stochastic_service_composition.services import (
+    Service,
+    build_service_from_transitions,
+)
+from stochastic_service_composition.solvers import evaluate_policy, value_iteration
+from stochastic_service_composition.sparse_mdp import SparseMDP
+from tests.conftest import GAMMA
+
+
+def test_lifted_symmetric_policy_is_optimal(dfa: SimpleDFA, services: List[Service], mdp: SparseMDP) -> None:
+    """Test that the policy of the symmetry-reduced MDP, lifted to the concrete states, is optimal."""
+    reduced = cast(SparseMDP, comp_mdp(dfa, services, gamma=GAMMA, sparse=True, symmetry=True))
+    assert reduced.nb_states < mdp.nb_states
+    lifted_policy = lift_symmetric_policy(value_iteration(reduced, tol=1e-10).policy, services)
+    actions = lifted_policy.get_state_to_action_map()
+    assert set(actions) >= set(mdp.states)
+
+    policy_rows = np.array(
+        [
+            next(
+                row
+                for row in range(mdp.state_ptr[state_id], mdp.state_ptr[state_id + 1])
+                if mdp.actions[mdp.row_actions[row]] == actions[state]
+            )
+            for state_id, state in enumerate(mdp.states)
+        ]
+    )
+    optimal_values = value_iteration(mdp, tol=1e-10).values
+    assert np.allclose(evaluate_policy(mdp, policy_rows), optimal_values, rtol=0.0, atol=1e-8)
+
+
+def test_partial_order_requires_undiscounted_mdp(dfa: SimpleDFA, services: List[Service]) -> None:
+    """Test that the partial order reduction is rejected with discounting, and exact without."""
+    with pytest.raises(AssertionError, match="gamma == 1"):
+        comp_mdp(dfa, services, gamma=GAMMA, sparse=True, partial_order=True)
+    full = cast(SparseMDP, comp_mdp(dfa, services, gamma=1.0, sparse=True))
+    reduced = cast(SparseMDP, comp_mdp(dfa, services, gamma=1.0, sparse=True, partial_order=True))
+    assert reduced.nb_rows < full.nb_rows
+    expected = value_iteration(full, tol=1e-10).get_value_func_dict()
+    for state, value in value_iteration(reduced, tol=1e-10).get_value_func_dict().items():
+        assert np.isclose(value, expected[state], rtol=0.0, atol=1e-6)
+
+
+def _checked_service(action: str) -> Service:
+    """Build a service that must be checked, with a free deterministic move, after its action."""
+    return build_service_from_transitions(
+        {
+            "ready": {action: ({"done": 1.0}, -1.0)},
+            "done": {f"check_{action}": ({"ready": 1.0}, 0.0)},
+        },
+        "ready",
+        {"ready"},
+    )
+
+
+def test_partial_order_removes_the_diamond_of_the_checks() -> None:
+    """Test that the two checks are not interleaved: the state where both services are done is not explored."""
+    transitions = {0: {"a": 1}, 1: {"a": 2, "b": 2}, 2: {"a": 3, "b": 3}}
+    dfa = SimpleDFA({0, 1, 2, 3}, {"a", "b"}, 0, {3}, transitions)
+    services = [_checked_service("a"), _checked_service("b")]
+    full = cast(SparseMDP, comp_mdp(dfa, services, gamma=1.0, sparse=True))
+    reduced = cast(SparseMDP, comp_mdp(dfa, services, gamma=1.0, sparse=True, partial_order=True))
+    assert full.state_encoder is not None
+    both_done = (full.state_encoder.encode(("done", "done")), 2)
+    assert both_done in full.state_index
+    assert both_done not in reduced.state_index
+    assert reduced.nb_states < full.nb_states
+    expected = value_iteration(full, tol=1e-10).get_value_func_dict()
+    for state, value in value_iteration(reduced, tol=1e-10).get_value_func_dict().items():
+        assert np.isclose(value, expected[state], rtol=0.0, atol=1e-8)
+
+
+def test_update_service_rejects_reduced_mdps(dfa: SimpleDFA, services: List[Service], mdp: SparseMDP) -> None:
+    """Test that the services of the symmetry-reduced and of the compressed MDPs cannot be patched."""
+    reduced = cast(SparseMDP, comp_mdp(dfa, services, gamma=GAMMA, sparse=True, symmetry=True))
+    with pytest.raises(AssertionError, match="symmetry-reduced"):
+        update_service(reduced, services, 2, services[2])
+    compressed = compress_chains(mdp).compressed
+    assert compressed.row_steps is not None
+    with pytest.raises(AssertionError, match="several steps"):
+        update_service(compressed, services, 2, services[2])
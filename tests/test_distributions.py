@@ -0,0 +1,20 @@
+"""Tests for the hash-consed probability distributions."""
+from stochastic_service_composition.distributions import Distribution
+
+
+def test_distribution_does_not_depend_on_order() -> None:
+    """Test that equal distributions, built in different orders, are the same object with the same hash."""
+    first = Distribution({"done": 0.9, "broken": 0.1})
+    second = Distribution([("broken", 0.1), ("done", 0.9)])
+    assert first is second
+    assert first == {"broken": 0.1, "done": 0.9}
+    assert hash(first) == hash(second)
+    assert len({first, second}) == 1
+
+
+def test_distribution_differs_by_probabilities() -> None:
+    """Test that distributions with the same outcomes and different probabilities are different."""
+    first = Distribution({"done": 0.9, "broken": 0.1})
+    second = Distribution({"done": 0.1, "broken": 0.9})
+    assert first is not second
+    assert first != second
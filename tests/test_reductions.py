@@ -0,0 +1,104 @@
+"""Tests for the reductions of sparse composition MDPs."""
+from typing import List, cast
+
+import numpy as np
+from pythomata import SimpleDFA
+
+from stochastic_service_composition.composition_mdp import (
+    COMPOSITION_MDP_SINK_STATE,
+    comp_mdp,
+    composition_mdp,
+)
+from stochastic_service_composition.reductions import (
+    bisimulation_quotient,
+    prune_comp_mdp,
+    prune_composition_mdp,
+)
+from stochastic_service_composition.services import (
+    Service,
+    build_service_from_transitions,
+)
+from stochastic_service_composition.solvers import value_iteration
+from stochastic_service_composition.sparse_mdp import SparseMDP
+from stochastic_service_composition.target import build_target_from_transitions
+from tests.conftest import GAMMA
+
+
+def _fragile_services(wait_reward: float = 0.0) -> List[Service]:
+    """Get free services for 'a', 'b' and 'c'; the one for 'b' can break forever, and then only wait."""
+    return [
+        build_service_from_transitions({"ready": {"a": ({"ready": 1.0}, 0.0)}}, "ready", {"ready"}),
+        build_service_from_transitions(
+            {
+                "ready": {"b": ({"ready": 0.8, "dead": 0.2}, 0.0)},
+                "dead": {"wait": ({"dead": 1.0}, wait_reward)},
+            },
+            "ready",
+            {"ready"},
+        ),
+        build_service_from_transitions({"ready": {"c": ({"ready": 1.0}, 0.0)}}, "ready", {"ready"}),
+    ]
+
+
+def _initial_value(mdp: SparseMDP) -> float:
+    """Get the optimal value of the initial state."""
+    result = value_iteration(mdp, tol=1e-10)
+    return result.values[mdp.state_index[mdp.initial_state]]
+
+
+def test_prune_composition_mdp_keeps_initial_value() -> None:
+    """Test that pruning the composition MDP of a target keeps the states that enter its final state."""
+    target = build_target_from_transitions(
+        {
+            "t0": {"a": ("t1", 1.0, 0.0)},
+            "t1": {"b": ("t2", 1.0, 0.0)},
+            "t2": {"b": ("t3", 1.0, 0.0)},
+            "t3": {"c": ("t4", 1.0, 1.0)},
+        },
+        "t0",
+        {"t4"},
+    )
+    mdp = cast(SparseMDP, composition_mdp(target, *_fragile_services(), gamma=GAMMA, sparse=True))
+    pruned, removed_states, _ = prune_composition_mdp(mdp, target)
+    assert removed_states > 0
+    assert np.isclose(_initial_value(pruned), _initial_value(mdp), rtol=0.0, atol=1e-8)
+
+
+def test_prune_comp_mdp_keeps_initial_value() -> None:
+    """Test that pruning the composition MDP of a DFA goal keeps the optimal value of the initial state."""
+    dfa = SimpleDFA({0, 1, 2, 3, 4}, {"a", "b", "c"}, 0, {4}, {0: {"a": 1}, 1: {"b": 2}, 2: {"b": 3}, 3: {"c": 4}})
+    mdp = cast(SparseMDP, comp_mdp(dfa, _fragile_services(), gamma=GAMMA, sparse=True))
+    pruned, removed_states, _ = prune_comp_mdp(mdp, dfa)
+    assert removed_states > 0
+    assert np.isclose(_initial_value(pruned), _initial_value(mdp), rtol=0.0, atol=1e-8)
+
+
+def test_prune_keeps_states_with_costs() -> None:
+    """Test that the states that can only pay costs, without reaching the goal, are not collapsed into the sink."""
+    dfa = SimpleDFA({0, 1, 2, 3, 4}, {"a", "b", "c"}, 0, {4}, {0: {"a": 1}, 1: {"b": 2}, 2: {"b": 3}, 3: {"c": 4}})
+    mdp = cast(SparseMDP, comp_mdp(dfa, _fragile_services(wait_reward=-1.0), gamma=GAMMA, sparse=True))
+    pruned, _, _ = prune_comp_mdp(mdp, dfa)
+    expected = value_iteration(mdp, tol=1e-10).get_value_func_dict()
+    actual = value_iteration(pruned, tol=1e-10).get_value_func_dict()
+    for state, value in actual.items():
+        if state in expected:
+            assert np.isclose(value, expected[state], rtol=0.0, atol=1e-8)
+
+
+def test_prune_does_not_count_the_sink_swap(dfa: SimpleDFA, mdp: SparseMDP) -> None:
+    """Test that a community with costs, whose only dead end is the sink, is left as is."""
+    assert COMPOSITION_MDP_SINK_STATE in mdp.state_index
+    pruned, removed_states, removed_transitions = prune_comp_mdp(mdp, dfa)
+    assert pruned is mdp
+    assert (removed_states, removed_transitions) == (0, 0)
+
+
+def test_bisimulation_merges_duplicate_services(dfa: SimpleDFA, services: List[Service], mdp: SparseMDP) -> None:
+    """Test that the quotient merges the states that differ by a permutation of the two identical services."""
+    quotient = bisimulation_quotient(mdp)
+    symmetric = cast(SparseMDP, comp_mdp(dfa, services, gamma=GAMMA, sparse=True, symmetry=True))
+    assert quotient.quotient.nb_states < mdp.nb_states
+    assert quotient.quotient.nb_states <= symmetric.nb_states
+    expected = value_iteration(mdp, tol=1e-10)
+    lifted = quotient.lift(value_iteration(quotient.quotient, tol=1e-10))
+    assert np.allclose(lifted.values, expected.values, rtol=0.0, atol=1e-8)
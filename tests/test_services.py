@@ -0,0 +1,35 @@
+"""Tests for the compact services and targets."""
+import pickle
+from typing import List
+
+from stochastic_service_composition.services import Service
+from stochastic_service_composition.target import build_target_from_transitions
+
+
+def test_compact_service_views(services: List[Service]) -> None:
+    """Test the views of a compact service: built once, without per-instance dicts, and picklable."""
+    service = services[2]
+    assert not hasattr(service, "__dict__")
+    assert service.transition_function is service.transition_function
+    assert dict(service.transition_function["available"]["b"][0]) == {"done": 0.9, "broken": 0.1}
+    assert service.transition_function["available"]["b"][1] == -1.0
+    assert "check_b" not in service.transition_function["available"]
+    assert [] not in service.transition_function["available"]
+    assert list(service.transition_function["done"]) == ["check_b"]
+    copy = pickle.loads(pickle.dumps(service, pickle.HIGHEST_PROTOCOL))
+    assert dict(copy.transition_function["broken"]["check_b"][0]) == {"available": 1.0}
+
+
+def test_compact_target_views() -> None:
+    """Test the views of a compact target."""
+    target = build_target_from_transitions(
+        {"t0": {"a": ("t1", 0.3, 1.0), "b": ("t0", 0.7, 0.0)}, "t1": {"c": ("t2", 1.0, 2.0)}},
+        "t0",
+        {"t2"},
+    )
+    assert not hasattr(target, "__dict__")
+    assert target.policy is target.policy
+    assert target.transition_function["t0"]["a"] == "t1"
+    assert dict(target.policy["t0"]) == {"a": 0.3, "b": 0.7}
+    assert target.reward["t1"]["c"] == 2.0
+    assert "t2" not in target.transition_function
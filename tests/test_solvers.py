@@ -0,0 +1,76 @@
+"""Tests for the sparse MDP solvers."""
+from typing import List, cast
+
+import numpy as np
+from pythomata import SimpleDFA
+
+from stochastic_service_composition.composition_mdp import comp_mdp
+from stochastic_service_composition.reductions import (
+    bisimulation_quotient,
+    compress_chains,
+    prune_comp_mdp,
+)
+from stochastic_service_composition.services import Service
+from stochastic_service_composition.solvers import (
+    POLICY_EVALUATION_DIRECT,
+    POLICY_EVALUATION_ITERATIVE,
+    evaluate_policy,
+    policy_iteration,
+    topological_value_iteration,
+    value_iteration,
+)
+from stochastic_service_composition.sparse_mdp import SparseMDP
+from tests.conftest import GAMMA
+
+
+def test_iterative_policy_evaluation_matches_direct(mdp: SparseMDP) -> None:
+    """Test that BiCGSTAB evaluates a policy as accurately as the sparse LU solver."""
+    policy_rows = value_iteration(mdp).policy_rows
+    direct = evaluate_policy(mdp, policy_rows, method=POLICY_EVALUATION_DIRECT)
+    iterative = evaluate_policy(mdp, policy_rows, method=POLICY_EVALUATION_ITERATIVE, tol=1e-10)
+    assert np.allclose(iterative, direct, rtol=0.0, atol=1e-8)
+
+
+def test_iterative_policy_evaluation_of_large_rewards(mdp: SparseMDP) -> None:
+    """Test that the iterative evaluation stops on the absolute residual, whatever the scale of the rewards."""
+    mdp = mdp.with_rewards(mdp.rewards * 1e6)
+    policy_rows = value_iteration(mdp).policy_rows
+    direct = evaluate_policy(mdp, policy_rows, method=POLICY_EVALUATION_DIRECT)
+    iterative = evaluate_policy(
+        mdp,
+        policy_rows,
+        method=POLICY_EVALUATION_ITERATIVE,
+        initial_values=np.full(mdp.nb_states, -1.0),
+    )
+    assert np.allclose(iterative, direct, rtol=0.0, atol=1e-5)
+
+
+def test_solvers_and_reductions_agree(dfa: SimpleDFA, services: List[Service]) -> None:
+    """Test that all the solvers, and the solutions lifted from the reduced MDPs, have the same values."""
+    # a single service for each symbol: a broken service is the only one that can move, with its check
+    mdp = cast(SparseMDP, comp_mdp(dfa, [services[0], services[2], services[4]], gamma=GAMMA, sparse=True))
+    expected = value_iteration(mdp, tol=1e-12).values
+    results = {
+        "topological value iteration": topological_value_iteration(mdp, tol=1e-12),
+        "policy iteration (direct)": policy_iteration(mdp, method=POLICY_EVALUATION_DIRECT),
+        "policy iteration (iterative)": policy_iteration(
+            mdp, tol=1e-12, method=POLICY_EVALUATION_ITERATIVE
+        ),
+    }
+    quotient = bisimulation_quotient(mdp)
+    assert quotient.quotient.nb_states < mdp.nb_states
+    results["bisimulation quotient"] = quotient.lift(value_iteration(quotient.quotient, tol=1e-12))
+    compression = compress_chains(mdp)
+    assert compression.compressed.nb_states < mdp.nb_states
+    results["chain compression"] = compression.lift(value_iteration(compression.compressed, tol=1e-12))
+    for name, result in results.items():
+        assert np.allclose(result.values, expected, rtol=0.0, atol=1e-8), name
+        # the policy is optimal as well
+        policy_values = evaluate_policy(mdp, result.policy_rows)
+        assert np.allclose(policy_values, expected, rtol=0.0, atol=1e-8), name
+
+    pruned, _, _ = prune_comp_mdp(mdp, dfa)
+    pruned_values = value_iteration(pruned, tol=1e-12).get_value_func_dict()
+    for state_id, state in enumerate(mdp.states):
+        if state in pruned_values:
+            assert np.isclose(pruned_values[state], expected[state_id], rtol=0.0, atol=1e-8)